@@ -1,7 +1,14 @@
+import hashlib
 import logging
 import os
+import random
+import threading
 import time
 from abc import ABC
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
 import configparser
 from multiprocessing import Queue
@@ -9,34 +16,368 @@ from multiprocessing import Queue
 import requests
 from bs4 import BeautifulSoup
 
+from book_manifest import BookManifest
+from instrumentation import BookInstrumentation, TimedHTTPAdapter
+from page_cache import NO_PAGE_CACHE, PAGE_CACHE, PageCache
+from output_formats import OUTPUT_FOLDER, RECOMPRESS_NONE
+from output_packager import OutputPackager, create_packager
+from page_recompressor import PageRecompressor
+from progress_events import STAGE_PAGES, ProgressReporter
+from session_store import SESSION_STORE, SessionStore
+
+
+class SessionPool:
+    """
+    Keeps one keep-alive session per host, so that pages and tiles of a book reuse
+    the same TCP/TLS connections instead of opening a new one for every request.
+    The pool size comes from the configuration of each library, so books configured differently
+    get separate sessions and never close each other's connections
+    """
+    POOL_SIZE = 10
+
+    def __init__(self):
+        # (host, pool size) -> session
+        self.sessions = dict()
+        self.request_counts = dict()
+        self.lock = threading.Lock()
+
+    def get_session(self, url, pool_size=POOL_SIZE):
+        host = urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get((host, pool_size))
+            if session is None:
+                session = requests.Session()
+                # pool_block makes the pool size a hard cap on parallel connections to one host
+                adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[(host, pool_size)] = session
+            self.request_counts[host] = self.request_counts.get(host, 0) + 1
+        return session
+
+    def get(self, url, pool_size=POOL_SIZE, **kwargs):
+        return self.get_session(url, pool_size).get(url, **kwargs)
+
+    def get_metrics(self):
+        """
+        @return: {host: {"requests": ..., "connections": ..., "reused": ...}}
+        """
+        connections = dict()
+        with self.lock:
+            for (host, _), session in self.sessions.items():
+                connections.setdefault(host, 0)
+                for adapter in set(session.adapters.values()):
+                    pools = adapter.poolmanager.pools
+                    for key in pools.keys():
+                        connection_pool = pools.get(key)
+                        if connection_pool is not None:
+                            connections[host] += connection_pool.num_connections
+            request_counts = dict(self.request_counts)
+        metrics = dict()
+        for host, connections_num in connections.items():
+            requests_num = request_counts.get(host, 0)
+            metrics[host] = {"requests": requests_num,
+                             "connections": connections_num,
+                             "reused": max(requests_num - connections_num, 0)}
+        return metrics
+
+
+SESSION_POOL = SessionPool()
+
+
+class HostRateLimiter:
+    """
+    Paces requests to one host: the pause between requests shrinks step by step while the host
+    answers quickly with 200 and is multiplied on 429/503 or when the server gets noticeably slower.
+    A step takes a share of the pause, so that a few successes undo a backoff and an occasional 429
+    does not make the pause grow for good
+    """
+    PAUSE_DECREASE_SEC = 0.05
+    PAUSE_DECREASE_FACTOR = 0.8
+    BACKOFF_FACTOR = 2
+    # backing off from a zero pause must still give the host a pause
+    MIN_BACKOFF_PAUSE_SEC = 0.1
+    # a response slower than this many times the best smoothed latency, and by at least MIN_SLOWDOWN_SEC,
+    # means the host is overloaded (small pages and big images of one host differ by milliseconds)
+    LATENCY_FACTOR = 3
+    MIN_SLOWDOWN_SEC = 0.5
+    LATENCY_SMOOTHING = 0.2
+    OVERLOAD_STATUS_CODES = (429, 503)
+
+    def __init__(self, pause_sec, min_pause_sec, max_pause_sec):
+        self.pause_sec = pause_sec
+        self.min_pause_sec = min(min_pause_sec, pause_sec)
+        self.max_pause_sec = max(max_pause_sec, pause_sec)
+        self.next_request_time = 0
+        self.last_backoff_time = None
+        self.latency = None
+        self.best_latency = None
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Sleep until the host has a free request slot and take it
+        @return: seconds slept
+        """
+        slept = 0
+        pause = self.reserve()
+        while pause > 0:
+            time.sleep(pause)
+            slept += pause
+            pause = self.reserve()
+        return slept
+
+    def reserve(self):
+        """
+        Take the request slot of the host if it has come. A slot is never booked ahead: a request that has
+        to wait asks again, so a backoff, a shorter pause or a Retry-After applies to it as well
+        @return: 0 if the slot is taken, otherwise seconds until it comes
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.next_request_time:
+                return self.next_request_time - now
+            self.next_request_time = now + self.pause_sec
+        return 0
+
+    def record(self, status_code, latency, retry_after=None):
+        """
+        @param latency: time the server took to answer, without waiting for a free connection,
+        so that many requests queued on our side do not look like an overloaded host
+        """
+        with self.lock:
+            if status_code in self.OVERLOAD_STATUS_CODES:
+                self.back_off()
+                pause = self.pause_sec if retry_after is None else max(retry_after, self.pause_sec)
+                self.next_request_time = max(self.next_request_time, time.monotonic() + pause)
+                return
+            if status_code != 200:
+                return
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.LATENCY_SMOOTHING * (latency - self.latency)
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+            if self.latency > max(self.best_latency * self.LATENCY_FACTOR,
+                                  self.best_latency + self.MIN_SLOWDOWN_SEC):
+                self.back_off()
+                # start measuring from the slower level so that one slow period does not back off forever
+                self.best_latency = self.latency
+            else:
+                self.pause_sec = max(min(self.pause_sec * self.PAUSE_DECREASE_FACTOR,
+                                         self.pause_sec - self.PAUSE_DECREASE_SEC), self.min_pause_sec)
+
+    def back_off(self):
+        """
+        Multiply the pause at most once per pause: the other answers to the requests already in flight
+        say nothing new about the host
+        """
+        now = time.monotonic()
+        if self.last_backoff_time is not None and now - self.last_backoff_time < self.pause_sec:
+            return
+        self.last_backoff_time = now
+        self.pause_sec = min(max(self.pause_sec * self.BACKOFF_FACTOR, self.MIN_BACKOFF_PAUSE_SEC),
+                             max(self.max_pause_sec, self.MIN_BACKOFF_PAUSE_SEC))
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+class RateLimiterPool:
+    def __init__(self):
+        self.limiters = dict()
+        self.lock = threading.Lock()
+
+    def get_limiter(self, url, pause_sec, min_pause_sec, max_pause_sec):
+        host = urlsplit(url).netloc
+        with self.lock:
+            limiter = self.limiters.get(host)
+            if limiter is None:
+                limiter = HostRateLimiter(pause_sec, min_pause_sec, max_pause_sec)
+                self.limiters[host] = limiter
+        return limiter
+
+
+RATE_LIMITERS = RateLimiterPool()
+
+
+class AuthorizationRequired(Exception):
+    pass
+
+
+class PageRequestAttempts:
+    """
+    Retry decisions for one page of get_page_content, shared by the synchronous and the asynchronous client,
+    which differ only in how they send the request and wait: connection errors, timeouts and 5xx are retried
+    after a growing random pause, 429 is retried at once (the rate limiter of the host delays the attempt)
+    """
+
+    def __init__(self, downloader, url):
+        self.downloader = downloader
+        self.url = url
+        self.attempt = 0
+        self.rate_limited = 0
+
+    def after_error(self, error):
+        """
+        Call in the except block of a connection error or a timeout
+        @return: seconds to wait before the next attempt; the error is raised again if no attempts are left
+        """
+        self.attempt += 1
+        if self.attempt >= self.downloader.RETRY_NUM:
+            raise error
+        logging.error(f"Error downloading {self.url}: {error!r}")
+        self.downloader.instrumentation.add_retry()
+        return self.downloader.get_retry_pause(self.attempt)
+
+    def after_response(self, result):
+        """
+        @return: None if result is the page, otherwise seconds to wait before the next attempt
+        """
+        self.downloader.check_authorization(result)
+        status_code = result.status_code
+        if status_code == 200:
+            return None
+        if status_code != 429 and status_code not in self.downloader.RETRY_STATUS_CODES:
+            raise Exception(f"Error downloading {self.url}: {status_code}")
+        result.close()
+        if status_code == 429:
+            self.rate_limited += 1
+        else:
+            self.attempt += 1
+        if self.attempt >= self.downloader.RETRY_NUM or self.rate_limited >= self.downloader.RATE_LIMIT_RETRY_NUM:
+            raise Exception(f"Error downloading {self.url}: {status_code}")
+        logging.error(f"Error {status_code} received when downloading {self.url}")
+        self.downloader.instrumentation.add_retry()
+        if status_code == 429:
+            # the rate limiter of the host has backed off and delays the next attempt itself
+            return 0
+        return self.downloader.get_retry_pause(self.attempt)
+
 
 class LibraryDownloader(ABC):
     PAUSE_SEC = 1
+    MIN_PAUSE_SEC = 0.25
+    MAX_PAUSE_SEC = 60
     RETRY_NUM = 3
+    # a 429 only says that the host wants fewer requests; the rate limiter has slowed down already
+    RATE_LIMIT_RETRY_NUM = 10
+    # 5xx answers and connection errors are retried after a random pause of up to BACKOFF_SEC * 2 ** attempt
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+    BACKOFF_SEC = 1
+    MAX_BACKOFF_SEC = 30
+    CONNECT_TIMEOUT_SEC = 10
+    # longest silence of the server while reading a response, not the time of the whole download
+    READ_TIMEOUT_SEC = 60
+    PAGE_WORKERS = 4
+    CHUNK_SIZE = 1024 * 1024
     USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36"
     CONFIG_FILE = "config.ini"
     CONFIG_LOGIN = "login"
     CONFIG_PASSWORD = "password"
     CONFIG_FOLDER = "folder"
+    CONFIG_POOL_SIZE = "pool_size"
+    CONFIG_PAUSE = "pause"
+    CONFIG_MIN_PAUSE = "min_pause"
+    CONFIG_OUTPUT = "output"
+    CONFIG_RECOMPRESS = "recompress"
+    CONFIG_JPEG_QUALITY = "jpeg_quality"
+    CONFIG_CACHE = "cache"
+    CONFIG_CACHE_FOLDER = "cache_folder"
+    CONFIG_CACHE_SIZE_MB = "cache_size_mb"
+    CONFIG_PROMETHEUS = "prometheus"
+    CONFIG_CONNECT_TIMEOUT = "connect_timeout"
+    CONFIG_READ_TIMEOUT = "read_timeout"
+    CONFIG_HEDGE_REQUESTS = "hedge_requests"
+    # libraries that save page images can collect them into a PDF or an archive while downloading
+    OUTPUT_PACKAGING = True
 
     current_section: str = NotImplemented
+    URL_LOGIN: str = NotImplemented
     login: str = NotImplemented
     password: str = NotImplemented
     last_page: int = NotImplemented
     folder: str = NotImplemented
     root_folder: str = NotImplemented
     section_folder: str = NotImplemented
+    manifest: BookManifest = NotImplemented
+    session_pool: SessionPool = SESSION_POOL
+    pool_size: int = SessionPool.POOL_SIZE
+    rate_limiters: RateLimiterPool = RATE_LIMITERS
+    session_store: SessionStore = SESSION_STORE
+    page_cache: PageCache = NO_PAGE_CACHE
+    pause_sec: float = NotImplemented
+    min_pause_sec: float = NotImplemented
+    output_format: str = OUTPUT_FOLDER
+    packager: OutputPackager = None
+    recompress_method: str = RECOMPRESS_NONE
+    jpeg_quality: int = PageRecompressor.JPEG_QUALITY
+    recompressor: PageRecompressor = None
+    instrumentation: BookInstrumentation = NotImplemented
+    progress_reporter: ProgressReporter = None
+    prometheus: bool = False
+    connect_timeout_sec: float = CONNECT_TIMEOUT_SEC
+    read_timeout_sec: float = READ_TIMEOUT_SEC
+    hedge_requests: bool = False
+    hedge_latencies: deque = None
+    hedge_lock: threading.Lock = None
 
     @classmethod
     def download_book(cls, book_url, queue: Queue):
         pass
 
     def make_pause(self):
+        """
+        Fixed pause for browser interactions; HTTP requests are paced per host in http_get
+        """
         time.sleep(self.PAUSE_SEC)
 
     def init_common(self):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
+    def init_http(self, config):
+        self.instrumentation = BookInstrumentation(self.current_section)
+        self.prometheus = config.getboolean(self.current_section, self.CONFIG_PROMETHEUS, fallback=False)
+        self.connect_timeout_sec = config.getfloat(self.current_section, self.CONFIG_CONNECT_TIMEOUT,
+                                                   fallback=self.CONNECT_TIMEOUT_SEC)
+        self.read_timeout_sec = config.getfloat(self.current_section, self.CONFIG_READ_TIMEOUT,
+                                                fallback=self.READ_TIMEOUT_SEC)
+        self.hedge_requests = config.getboolean(self.current_section, self.CONFIG_HEDGE_REQUESTS, fallback=False)
+        self.hedge_latencies = deque(maxlen=200)
+        self.hedge_lock = threading.Lock()
+        self.pool_size = config.getint(self.current_section, self.CONFIG_POOL_SIZE, fallback=SessionPool.POOL_SIZE)
+        self.pause_sec = config.getfloat(self.current_section, self.CONFIG_PAUSE, fallback=self.PAUSE_SEC)
+        self.min_pause_sec = config.getfloat(self.current_section, self.CONFIG_MIN_PAUSE,
+                                             fallback=self.MIN_PAUSE_SEC)
+        self.output_format = config.get(self.current_section, self.CONFIG_OUTPUT, fallback=OUTPUT_FOLDER)
+        self.recompress_method = config.get(self.current_section, self.CONFIG_RECOMPRESS, fallback=RECOMPRESS_NONE)
+        self.jpeg_quality = config.getint(self.current_section, self.CONFIG_JPEG_QUALITY,
+                                          fallback=PageRecompressor.JPEG_QUALITY)
+        # the page cache costs two more file writes per page, so it is used only if asked for
+        if not config.getboolean(self.current_section, self.CONFIG_CACHE, fallback=False):
+            self.page_cache = NO_PAGE_CACHE
+        elif config.has_option(self.current_section, self.CONFIG_CACHE_FOLDER) or \
+                config.has_option(self.current_section, self.CONFIG_CACHE_SIZE_MB):
+            cache_size_mb = config.getfloat(self.current_section, self.CONFIG_CACHE_SIZE_MB,
+                                            fallback=PageCache.MAX_SIZE / (1024 * 1024))
+            self.page_cache = PageCache(config.get(self.current_section, self.CONFIG_CACHE_FOLDER,
+                                                   fallback=PageCache.CACHE_FOLDER),
+                                        int(cache_size_mb * 1024 * 1024))
+        else:
+            self.page_cache = PAGE_CACHE
+
     def init_authorized_access(self, config=None):
         self.init_common()
         if config is None:
@@ -53,9 +394,36 @@ class LibraryDownloader(ABC):
         else:
             self.root_folder = config.get(self.current_section, self.CONFIG_FOLDER)
         logging.info(f"Using folder {os.path.abspath(self.root_folder)}")
+        self.init_http(config)
         self.login = config.get(self.current_section, self.CONFIG_LOGIN)
         self.password = config.get(self.current_section, self.CONFIG_PASSWORD)
 
+    def run_authorized(self, download, log_in):
+        """
+        Call download(cookies) with the stored session of the library. If there is no valid session
+        or the library does not accept it, call log_in() -> cookies, store them and download again
+        """
+        cookies = self.session_store.get_cookies(self.current_section, self.login)
+        if cookies is not None:
+            try:
+                logging.info("Using stored session")
+                return download(cookies)
+            except AuthorizationRequired:
+                logging.info("Stored session is not valid anymore, logging in again")
+                self.session_store.invalidate(self.current_section, self.login)
+        cookies = log_in()
+        self.session_store.save_cookies(self.current_section, self.login, cookies)
+        return download(cookies)
+
+    @staticmethod
+    def cookies_to_header(cookies):
+        return ";".join([c["name"] + "=" + c["value"] for c in cookies])
+
+    def check_authorization(self, result):
+        if result.status_code == 401 or \
+                (self.URL_LOGIN is not NotImplemented and result.url.startswith(self.URL_LOGIN)):
+            raise AuthorizationRequired(f"Not logged in to {self.current_section}")
+
     def init_non_authorized_access(self, config=None):
         self.init_common()
         if config is None:
@@ -66,41 +434,223 @@ class LibraryDownloader(ABC):
         else:
             self.root_folder = config.get(self.current_section, self.CONFIG_FOLDER)
         logging.info(f"Using folder {os.path.abspath(self.root_folder)}")
+        self.init_http(config)
 
     def create_folders(self, book_id):
         self.folder = os.path.join(self.root_folder, self.current_section + "_" + book_id)
         os.makedirs(self.folder, exist_ok=True)
+        self.manifest = BookManifest(self.folder)
+        self.instrumentation.book_id = book_id
+        self.packager = create_packager(self.output_format if self.OUTPUT_PACKAGING else OUTPUT_FOLDER, self.folder)
+        self.recompressor = None
+        if self.OUTPUT_PACKAGING and self.recompress_method != RECOMPRESS_NONE:
+            self.recompressor = PageRecompressor(self.recompress_method, self.manifest, self.add_to_package,
+                                                 self.jpeg_quality, self.instrumentation)
+
+    def package_page(self, filename):
+        """
+        Pass a finished page to the recompressor and the packager; pages must come in page order
+        """
+        if filename is None:
+            return
+        if self.recompressor is not None:
+            self.recompressor.add_page(filename)
+        else:
+            self.add_to_package(filename)
+
+    def add_to_package(self, filename):
+        with self.instrumentation.stage("package"):
+            self.packager.add_page(filename)
+
+    def finish_packaging(self):
+        if self.recompressor is not None:
+            saved_bytes = self.recompressor.finish()
+            logging.info(f"Recompression saved {saved_bytes / (1024 * 1024):.1f} MB")
+        with self.instrumentation.stage("package"):
+            output_filename = self.packager.finish()
+        if output_filename is not None:
+            logging.info(f"Saved {output_filename}")
+
+    def abort_packaging(self):
+        if self.recompressor is not None:
+            self.recompressor.abort()
+        if self.packager is not None:
+            self.packager.abort()
+
+    def get_progress_reporter(self):
+        # the queue is given to download_book, so the reporter follows it
+        if self.progress_reporter is None or self.progress_reporter.queue is not self.queue:
+            self.progress_reporter = ProgressReporter(self.queue)
+        return self.progress_reporter
+
+    def report_progress(self, done, total, stage=STAGE_PAGES):
+        self.get_progress_reporter().update(done, total, stage)
+
+    def save_metrics(self):
+        """
+        Write the timing report of the book (metrics.json and, if configured, metrics.prom) into its folder
+        """
+        if self.folder is NotImplemented or not os.path.isdir(self.folder):
+            return
+        try:
+            self.instrumentation.save(self.folder, self.prometheus)
+        except OSError as e:
+            logging.error(f"Could not save metrics: {e}")
 
     def create_common_section_folder(self):
         self.section_folder = os.path.join(self.root_folder, self.current_section)
         os.makedirs(self.section_folder, exist_ok=True)
 
-    def get_page_content(self, url, additional_headers=None):
-        if additional_headers is None:
-            additional_headers = dict()
-        i = 0
-        result = None
-        headers = {"User-Agent": self.USER_AGENT}
-        headers.update(additional_headers)
-        while i < self.RETRY_NUM:
-            result = requests.get(url, headers=headers)
-            i += 1
-            if result.status_code == 429:
-                logging.error(f"Error {result.status_code} received when downloading {url}")
-                self.make_pause()
-            elif result.status_code == 200:
-                break
+    def download_page_list(self, pages, download_page, on_page_done=None):
+        """
+        Download pages known in advance, up to PAGE_WORKERS at a time; every request still waits for
+        the rate limiter of its host. Progress, packaging and on_page_done(page_num, result) follow the page order
+        @param download_page: function(page, page_num) -> filename of the saved page or None
+        """
+        total_page_num = len(pages)
+        page_workers = min(self.PAGE_WORKERS, self.pool_size)
+        executor = ThreadPoolExecutor(max_workers=page_workers)
+        try:
+            futures = [executor.submit(download_page, page, page_num) for page_num, page in enumerate(pages)]
+            for page_num, future in enumerate(futures):
+                result = future.result()
+                self.package_page(result)
+                if on_page_done is not None:
+                    on_page_done(page_num, result)
+                self.report_progress(page_num + 1, total_page_num)
+        finally:
+            # after an error the pages that have not started yet are not downloaded
+            executor.shutdown(cancel_futures=True)
+
+    def http_get(self, url, **kwargs):
+        limiter = self.rate_limiters.get_limiter(url, self.pause_sec, self.min_pause_sec, self.MAX_PAUSE_SEC)
+        self.instrumentation.add_pause(limiter.wait())
+        start = time.monotonic()
+        timing = self.instrumentation.start_request(url)
+        kwargs.setdefault("timeout", (self.connect_timeout_sec, self.read_timeout_sec))
+        try:
+            result = self.session_pool.get(url, self.pool_size, **kwargs)
+        except Exception:
+            self.instrumentation.finish_request(timing, "error", 0)
+            raise
+        size = None if kwargs.get("stream") else len(result.content)
+        self.instrumentation.finish_request(timing, result.status_code, size)
+        if size:
+            self.get_progress_reporter().add_bytes(size)
+        # the time to the response headers leaves out waiting for a free connection
+        limiter.record(result.status_code, timing.phases["ttfb"] or time.monotonic() - start,
+                       limiter.parse_retry_after(result.headers.get("Retry-After")))
+        return result
+
+    def log_connection_metrics(self):
+        for host, host_metrics in self.session_pool.get_metrics().items():
+            logging.info(f"{host}: {host_metrics['requests']} requests over "
+                         f"{host_metrics['connections']} connections")
+
+    def get_page_content(self, url, additional_headers=None, stream=False, cache_key=None):
+        """
+        @param cache_key: canonical name of the page (URL or page id) to look up in the page cache first;
+        a cached page is returned as a finished response and the content of a new one is cached
+        """
+        if self.uses_page_cache(cache_key):
+            cached_result = self.get_cached_page(url, cache_key)
+            if cached_result is not None:
+                return cached_result
+            # the whole content is needed for the cache anyway
+            stream = False
+        headers = self.make_headers(additional_headers)
+        attempts = PageRequestAttempts(self, url)
+        while True:
+            try:
+                result = self.http_get(url, headers=headers, stream=stream)
+            except self.RETRY_EXCEPTIONS as e:
+                pause = attempts.after_error(e)
             else:
-                raise Exception(f"Error downloading {url}: {result.status_code}")
-        if result.status_code == 429:
-            raise Exception(f"Error downloading {url}: {result.status_code}")
+                pause = attempts.after_response(result)
+                if pause is None:
+                    break
+            self.wait_before_retry(pause)
+        if self.uses_page_cache(cache_key):
+            self.page_cache.put(cache_key, result.content)
         return result
 
-    def save_image(self, url, output_filename):
-        result = self.get_page_content(url)
-        image = result.content
-        with open(output_filename, 'wb') as fout:
-            fout.write(image)
+    def make_headers(self, additional_headers=None):
+        headers = {"User-Agent": self.USER_AGENT}
+        headers.update(additional_headers or dict())
+        return headers
+
+    def uses_page_cache(self, cache_key):
+        return cache_key is not None and self.page_cache.is_enabled()
+
+    def get_cached_page(self, url, cache_key):
+        """
+        @return: the page from the page cache as a finished response or None
+        """
+        content = self.page_cache.get(cache_key)
+        if content is None:
+            return None
+        logging.info(f"Taken from cache: {cache_key}")
+        return self.make_cached_response(url, content)
+
+    def wait_before_retry(self, pause):
+        if pause > 0:
+            time.sleep(pause)
+            self.instrumentation.add_pause(pause)
+
+    def get_retry_pause(self, attempt):
+        """
+        Exponential backoff with full jitter, so that the workers that failed together do not retry together
+        @return: seconds to wait before the next attempt
+        """
+        return random.uniform(0, min(self.BACKOFF_SEC * 2 ** (attempt - 1), self.MAX_BACKOFF_SEC))
+
+    @staticmethod
+    def make_cached_response(url, content):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    def save_image(self, url, output_filename, cache_key=None):
+        """
+        @return: SHA-256 of the saved file
+        """
+        result = self.get_page_content(url, stream=True, cache_key=cache_key)
+        return self.save_response(result, output_filename)
+
+    def save_response(self, response, output_filename, hash_name="sha256"):
+        """
+        Write the response body chunk by chunk into a temporary file which replaces output_filename
+        only when complete, so that an interrupted download never looks like a finished one
+        @return: hex digest of the content or None if hash_name is None
+        """
+        checksum = hashlib.new(hash_name) if hash_name else None
+        temporary_filename = output_filename + ".part"
+        # responses read in full (not streamed, or from the cache) are counted by http_get already
+        streamed = not response._content_consumed
+        start = time.perf_counter()
+        size = 0
+        try:
+            with open(temporary_filename, 'wb') as fout:
+                for chunk in response.iter_content(self.CHUNK_SIZE):
+                    fout.write(chunk)
+                    size += len(chunk)
+                    if streamed:
+                        self.get_progress_reporter().add_bytes(len(chunk))
+                    if checksum:
+                        checksum.update(chunk)
+            os.replace(temporary_filename, output_filename)
+            if streamed:
+                self.instrumentation.add_transfer(response.url, time.perf_counter() - start, size)
+        except BaseException:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+        finally:
+            response.close()
+        return checksum.hexdigest() if checksum else None
 
     def download_html(self, url, additional_headers=None):
         if additional_headers is None:
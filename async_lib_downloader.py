@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import asyncio
+import atexit
+import hashlib
+import inspect
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from abstract_lib_downloader import LibraryDownloader, PageRequestAttempts
+from instrumentation import RequestTiming
+
+
+class EventLoopThread:
+    """
+    One asyncio event loop in a background thread, shared by all books downloaded in the process.
+    Synchronous code hands coroutines to it and waits for their results
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="elib-event-loop", daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def submit(self, coroutine):
+        """
+        @return: concurrent.futures.Future of the result; cancelling it cancels the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+    def run(self, coroutine):
+        return self.submit(coroutine).result()
+
+    def stop(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            loop = self.loop
+            self.loop = None
+        asyncio.run_coroutine_threadsafe(ASYNC_SESSION_POOL.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join()
+        loop.close()
+
+
+EVENT_LOOP = EventLoopThread()
+atexit.register(EVENT_LOOP.stop)
+
+
+def make_trace_config():
+    """
+    Fills in the RequestTiming passed as trace_request_ctx. aiohttp does not report the TLS handshake
+    separately, so it is counted in "connect"
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_dns_resolvehost_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        context.dns_time = time.perf_counter() - context.dns_start
+        context.trace_request_ctx.phases["dns"] += context.dns_time
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = time.perf_counter()
+        context.dns_time = 0
+
+    async def on_connection_create_end(session, context, params):
+        timing = context.trace_request_ctx
+        timing.connected_time = time.perf_counter()
+        timing.phases["connect"] += timing.connected_time - context.connect_start - context.dns_time
+        timing.new_connection = True
+
+    async def on_connection_reuseconn(session, context, params):
+        context.trace_request_ctx.connected_time = time.perf_counter()
+
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace_config
+
+
+class AsyncSessionPool:
+    """
+    aiohttp counterpart of SessionPool: one client session per host and pool size
+    with at most pool_size connections. Used only from the event loop thread
+    """
+
+    def __init__(self):
+        # (host, pool size) -> session
+        self.sessions = dict()
+
+    async def get_session(self, url, pool_size):
+        key = (urlsplit(url).netloc, pool_size)
+        session = self.sessions.get(key)
+        if session is None:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, limit_per_host=pool_size),
+                                            trace_configs=[make_trace_config()])
+            self.sessions[key] = session
+        return session
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+
+ASYNC_SESSION_POOL = AsyncSessionPool()
+
+
+class AsyncLibraryDownloader(LibraryDownloader):
+    """
+    Base of the libraries that only need plain HTTP requests. Pages and tiles are coroutines on the shared
+    event loop, so thousands of them can wait for the rate limiter or a connection without a thread each;
+    download_book and the rest of the synchronous API stay as they are and wait for the loop
+    """
+    # a hedged request is repeated once it takes longer than this share of the recent requests
+    HEDGE_QUANTILE = 0.95
+    HEDGE_MIN_SAMPLES = 20
+    MIN_HEDGE_DELAY_SEC = 0.1
+    # the errors of the aiohttp client retried as RETRY_EXCEPTIONS are
+    ASYNC_RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+    event_loop: EventLoopThread = EVENT_LOOP
+    async_session_pool: AsyncSessionPool = ASYNC_SESSION_POOL
+
+    def run_async(self, coroutine):
+        return self.event_loop.run(coroutine)
+
+    def download_page_list(self, pages, download_page, on_page_done=None):
+        """
+        As LibraryDownloader.download_page_list, but download_page may be a coroutine function;
+        then the pages are downloaded on the event loop, up to pool_size at a time
+        """
+        if not inspect.iscoroutinefunction(download_page):
+            return super().download_page_list(pages, download_page, on_page_done)
+        total_page_num = len(pages)
+        semaphore = self.run_async(self.create_semaphore(self.pool_size))
+        futures = [self.event_loop.submit(self.run_limited(semaphore, download_page, page, page_num))
+                   for page_num, page in enumerate(pages)]
+        try:
+            for page_num, future in enumerate(futures):
+                result = future.result()
+                self.package_page(result)
+                if on_page_done is not None:
+                    on_page_done(page_num, result)
+                self.report_progress(page_num + 1, total_page_num)
+        finally:
+            # after an error the pages still waiting are not downloaded
+            for future in futures:
+                future.cancel()
+
+    def log_connection_metrics(self):
+        """
+        The aiohttp sessions are not in the session pool, so the connections are counted from the requests
+        of this book (both clients report whether a request opened a new connection)
+        """
+        for host, host_metrics in self.instrumentation.get_report()["hosts"].items():
+            logging.info(f"{host}: {host_metrics['requests']} requests over "
+                         f"{host_metrics['new_connections']} new connections")
+
+    @staticmethod
+    async def create_semaphore(value):
+        # created on the loop that uses it
+        return asyncio.Semaphore(value)
+
+    @staticmethod
+    async def run_limited(semaphore, coroutine_function, *args):
+        async with semaphore:
+            return await coroutine_function(*args)
+
+    async def http_get_async(self, url, headers=None):
+        """
+        @return: the whole response as a requests.Response, so that it can be checked like a synchronous one
+        """
+        limiter = self.rate_limiters.get_limiter(url, self.pause_sec, self.min_pause_sec, self.MAX_PAUSE_SEC)
+        pause = limiter.reserve()
+        while pause > 0:
+            await asyncio.sleep(pause)
+            self.instrumentation.add_pause(pause)
+            pause = limiter.reserve()
+        session = await self.async_session_pool.get_session(url, self.pool_size)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout_sec,
+                                        sock_read=self.read_timeout_sec)
+        start = time.monotonic()
+        timing = RequestTiming(urlsplit(url).netloc)
+        try:
+            async with session.get(url, headers=headers, timeout=timeout, trace_request_ctx=timing) as response:
+                timing.response_time = time.perf_counter()
+                timing.phases["ttfb"] += timing.response_time - (timing.connected_time or timing.start_time)
+                content = await response.read()
+                result = self.make_response(str(response.url), response.status, response.headers, content)
+        except Exception:
+            self.instrumentation.finish_request(timing, "error", 0)
+            raise
+        self.instrumentation.finish_request(timing, result.status_code, len(content))
+        if content:
+            self.get_progress_reporter().add_bytes(len(content))
+        # the time to the response headers leaves out waiting for a free connection
+        limiter.record(result.status_code, timing.phases["ttfb"] or time.monotonic() - start,
+                       limiter.parse_retry_after(result.headers.get("Retry-After")))
+        return result
+
+    @staticmethod
+    def make_response(url, status_code, headers, content):
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    async def get_page_content_async(self, url, additional_headers=None, cache_key=None):
+        """
+        Coroutine version of get_page_content with the same retries and the same page cache
+        """
+        if self.uses_page_cache(cache_key):
+            cached_result = await asyncio.to_thread(self.get_cached_page, url, cache_key)
+            if cached_result is not None:
+                return cached_result
+        headers = self.make_headers(additional_headers)
+        attempts = PageRequestAttempts(self, url)
+        while True:
+            try:
+                result = await self.http_get_async(url, headers)
+            except self.ASYNC_RETRY_EXCEPTIONS as e:
+                pause = attempts.after_error(e)
+            else:
+                pause = attempts.after_response(result)
+                if pause is None:
+                    break
+            await self.wait_before_retry_async(pause)
+        if self.uses_page_cache(cache_key):
+            await asyncio.to_thread(self.page_cache.put, cache_key, result.content)
+        return result
+
+    async def wait_before_retry_async(self, pause):
+        if pause > 0:
+            await asyncio.sleep(pause)
+            self.instrumentation.add_pause(pause)
+
+    async def get_page_content_hedged_async(self, url, cache_key=None):
+        """
+        get_page_content_async for small idempotent requests (tiles). If hedge_requests is set and the request
+        takes longer than HEDGE_QUANTILE of the recent ones, the same request is sent once more,
+        the answer that comes first is used and the slower copy is cancelled
+        """
+        if not self.hedge_requests:
+            return await self.get_page_content_async(url, cache_key=cache_key)
+        hedge_delay = self.get_hedge_delay()
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(self.get_page_content_async(url, cache_key=cache_key))]
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            logging.info(f"Hedging slow request {url}")
+            self.instrumentation.add_hedge()
+            tasks.append(asyncio.ensure_future(self.get_page_content_async(url, cache_key=cache_key)))
+        error = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    with self.hedge_lock:
+                        self.hedge_latencies.append(time.monotonic() - start)
+                    return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise error
+
+    def get_hedge_delay(self):
+        """
+        @return: seconds to wait before hedging a request or None if there are too few requests to tell
+        """
+        with self.hedge_lock:
+            latencies = sorted(self.hedge_latencies)
+        if len(latencies) < self.HEDGE_MIN_SAMPLES:
+            return None
+        return max(latencies[int(self.HEDGE_QUANTILE * (len(latencies) - 1))], self.MIN_HEDGE_DELAY_SEC)
+
+    async def save_image_async(self, url, output_filename, cache_key=None):
+        """
+        @return: SHA-256 of the saved file
+        """
+        result = await self.get_page_content_async(url, cache_key=cache_key)
+        return await asyncio.to_thread(self.write_page, result.content, output_filename)
+
+    @staticmethod
+    def write_page(content, output_filename):
+        """
+        Write the page through a temporary file, as save_response does
+        @return: SHA-256 of the content
+        """
+        temporary_filename = output_filename + ".part"
+        with open(temporary_filename, "wb") as fout:
+            fout.write(content)
+        os.replace(temporary_filename, output_filename)
+        return hashlib.sha256(content).hexdigest()
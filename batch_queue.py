@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import json
+import logging
+import os
+import threading
+import uuid
+
+from progress_events import ProgressEvent
+
+
+class BatchJob:
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, source, book_id, folder=".", job_id=None, status=STATUS_QUEUED, progress=0.0, message="",
+                 output=None, event=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.source = source
+        self.book_id = book_id
+        # None leaves the folder of config.ini
+        self.folder = folder
+        # output format of the book, None keeps the one from config.ini
+        self.output = output
+        # last ProgressEvent of the running download, as a dict
+        self.event = event
+        self.status = status
+        self.progress = progress
+        self.message = message
+
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def to_dict(self):
+        return {"job_id": self.job_id, "source": self.source, "book_id": self.book_id, "folder": self.folder,
+                "status": self.status, "progress": self.progress, "message": self.message, "output": self.output,
+                "event": self.event}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class JobProgressQueue:
+    """
+    Stands in for the progress queue of a single download and writes the progress into its job
+    """
+
+    def __init__(self, job_queue, job):
+        self.job_queue = job_queue
+        self.job = job
+
+    def put_nowait(self, event: ProgressEvent):
+        self.job_queue.update(self.job, progress=event.fraction, event=event.to_dict(), save=False)
+
+
+class JobQueue:
+    """
+    Persistent list of books to download, kept in a JSON file next to config.ini
+    (filename None keeps the list in memory only)
+    """
+    QUEUE_FILE = "jobs.json"
+
+    def __init__(self, filename=QUEUE_FILE):
+        self.filename = filename
+        self.jobs = []
+        self.lock = threading.RLock()
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with open(self.filename, encoding="utf-8") as fin:
+                    self.jobs = [BatchJob.from_dict(job) for job in json.load(fin)]
+            except (ValueError, TypeError) as e:
+                logging.error(f"Ignoring broken job queue {self.filename}: {e}")
+        for job in self.jobs:
+            # the process stopped in the middle of these books, the manifests let them continue
+            if job.status == BatchJob.STATUS_RUNNING:
+                job.status = BatchJob.STATUS_QUEUED
+
+    def add(self, source, book_id, folder=".", output=None):
+        job = BatchJob(source, book_id, folder, output=output)
+        with self.lock:
+            self.jobs.append(job)
+            self.save()
+        return job
+
+    def find(self, source, book_id, folder=None):
+        """
+        @param folder: None finds the job of the book whatever its folder
+        @return: the job of this book in the list or None
+        """
+        with self.lock:
+            for job in self.jobs:
+                if (job.source, job.book_id) == (source, book_id) and folder in (None, job.folder):
+                    return job
+        return None
+
+    def get_jobs(self):
+        with self.lock:
+            return list(self.jobs)
+
+    def next_job(self, busy_sources):
+        """
+        @return: the oldest queued job of a library that is not busy, or None
+        """
+        with self.lock:
+            for job in self.jobs:
+                if job.status == BatchJob.STATUS_QUEUED and job.source not in busy_sources:
+                    return job
+        return None
+
+    def update(self, job, save=True, **fields):
+        with self.lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            if save:
+                self.save()
+
+    def remove_finished(self):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if not job.is_finished()]
+            self.save()
+
+    def save(self):
+        if not self.filename:
+            return
+        with self.lock:
+            temporary_filename = self.filename + ".part"
+            with open(temporary_filename, "w", encoding="utf-8") as fout:
+                json.dump([job.to_dict() for job in self.jobs], fout, ensure_ascii=False, indent=1)
+            os.replace(temporary_filename, self.filename)
+
+
+class BatchScheduler:
+    """
+    Runs the jobs of a JobQueue: books from different libraries are downloaded at the same time,
+    because they go to different hosts, while the books of one library wait for each other
+    """
+    MAX_PARALLEL_JOBS = 4
+
+    def __init__(self, job_queue, download_functions, config_factory, max_parallel_jobs=MAX_PARALLEL_JOBS):
+        """
+        @param download_functions: {source: function(config, book_id, queue) -> (error_text, result)}
+        @param config_factory: function(job) -> ConfigParser for the download
+        """
+        self.job_queue = job_queue
+        self.download_functions = download_functions
+        self.config_factory = config_factory
+        self.max_parallel_jobs = max_parallel_jobs
+        self.busy_sources = set()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def wake_up(self):
+        with self.condition:
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                job = None
+                if len(self.busy_sources) < self.max_parallel_jobs:
+                    job = self.job_queue.next_job(self.busy_sources)
+                if job is None:
+                    self.condition.wait()
+                    continue
+                self.busy_sources.add(job.source)
+                self.job_queue.update(job, status=BatchJob.STATUS_RUNNING, progress=0.0, message="", event=None)
+            threading.Thread(target=self.run_job, args=(job,), daemon=True).start()
+
+    def run_job(self, job):
+        try:
+            download_function = self.download_functions[job.source]
+            error_text, result = download_function(self.config_factory(job), job.book_id,
+                                                   JobProgressQueue(self.job_queue, job))
+            if error_text:
+                self.job_queue.update(job, status=BatchJob.STATUS_FAILED, message=error_text)
+            else:
+                self.job_queue.update(job, status=BatchJob.STATUS_DONE, progress=1.0, message=result)
+        except Exception as e:
+            logging.error(f"Exception occurred {e}")
+            self.job_queue.update(job, status=BatchJob.STATUS_FAILED, message=str(e))
+        finally:
+            with self.condition:
+                self.busy_sources.discard(job.source)
+                self.condition.notify()
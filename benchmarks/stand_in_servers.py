@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Local HTTP stand-ins for the libraries, for benchmarks that must not touch the real sites.
+
+One server answers for all of them, each under its own path prefix:
+
+    /prlib   IIPImage-style tile server with the book page and the JSON metadata
+    /shpl    book page with the page list and /pages/<id>/zooms/8 images
+    /kazneb  book viewer page and FileStore images
+    /rgo     safe-view book page and base64 page URLs, "Error" after the last page
+    /pgpb    document page and one PDF per page
+
+Latency, the share of 429 answers and the payload sizes are configurable;
+only page payloads (tiles, images, page PDFs) get 429 answers, book pages never do.
+"""
+
+import base64
+import io
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+SOURCE_PREFIXES = {
+    "PRLIB": "/prlib",
+    "SHPL": "/shpl",
+    "KAZNEB": "/kazneb",
+    "RGO": "/rgo",
+    "PGPB": "/pgpb",
+}
+RGO_BOOK_FILE = "benchmark-book.pdf"
+
+
+def make_image(image_format, target_size, min_side=16):
+    """
+    Noise image of roughly target_size bytes (noise does not compress, so the size follows the pixel count)
+    @return: encoded image
+    """
+    side = 256
+    content = None
+    for _ in range(3):
+        noise = random.Random(side).randbytes(side * side * 3)
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", (side, side), noise).save(buffer, image_format)
+        content = buffer.getvalue()
+        side = max(min_side, int(side * (target_size / len(content)) ** 0.5))
+    return content
+
+
+def make_tile(tile_size):
+    noise = random.Random(tile_size).randbytes(tile_size * tile_size * 3)
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (tile_size, tile_size), noise).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class StandInOptions:
+    def __init__(self, page_count=20, page_size=200 * 1024, latency_sec=0.02, rate_429=0.0, retry_after_sec=0,
+                 tile_size=256, tiles_per_side=4, seed=1):
+        """
+        @param page_size: approximate size of a page image in bytes (PRLIB pages are made of tiles instead)
+        @param rate_429: share of page requests answered with 429 Too Many Requests
+        """
+        self.page_count = page_count
+        self.page_size = page_size
+        self.latency_sec = latency_sec
+        self.rate_429 = rate_429
+        self.retry_after_sec = retry_after_sec
+        self.tile_size = tile_size
+        self.tiles_per_side = tiles_per_side
+        self.seed = seed
+
+
+class StandInServer:
+    """
+    All stand-in libraries on one local port, with request and byte counters per library
+    """
+
+    def __init__(self, options=None):
+        self.options = options or StandInOptions()
+        self.random = random.Random(self.options.seed)
+        self.lock = threading.Lock()
+        self.counters = {source: {"requests": 0, "bytes": 0, "rejected": 0} for source in SOURCE_PREFIXES}
+        self.jpeg_page = make_image("JPEG", self.options.page_size)
+        self.png_page = make_image("PNG", self.options.page_size)
+        self.tile = make_tile(self.options.tile_size)
+        buffer = io.BytesIO()
+        Image.open(io.BytesIO(self.jpeg_page)).save(buffer, "PDF")
+        self.pdf_page = buffer.getvalue()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def get_url(self, source):
+        return self.base_url + SOURCE_PREFIXES[source]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            for counter in self.counters.values():
+                counter.update(requests=0, bytes=0, rejected=0)
+
+    def should_reject(self):
+        with self.lock:
+            return self.random.random() < self.options.rate_429
+
+    def count(self, source, size, rejected=False):
+        with self.lock:
+            counter = self.counters[source]
+            counter["requests"] += 1
+            counter["bytes"] += size
+            counter["rejected"] += int(rejected)
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, source, body, content_type="text/html; charset=utf-8", status=200, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                server.count(source, len(body), status == 429)
+
+            def send_payload(self, source, body, content_type):
+                time.sleep(server.options.latency_sec)
+                if server.should_reject():
+                    self.send(source, b"Too Many Requests", "text/plain", 429,
+                              {"Retry-After": str(server.options.retry_after_sec)})
+                else:
+                    self.send(source, body, content_type)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                for source, prefix in SOURCE_PREFIXES.items():
+                    if url.path.startswith(prefix + "/"):
+                        handle = getattr(server, "handle_" + source.lower())
+                        if handle(self, source, url.path[len(prefix):], parse_qs(url.query)):
+                            return
+                self.send_error(404)
+
+        return Handler
+
+    def handle_prlib(self, handler, source, path, query):
+        options = self.options
+        side = options.tile_size * options.tiles_per_side
+        if path.startswith("/item/"):
+            handler.send(source, b'<html><head><meta property="og:image" '
+                                 b'content="https://example.org/book_preview/bench/1.jpg"></head><body>'
+                                 b'<div class="diva-viewer" data-filegroup="grp"></div></body></html>')
+        elif path.startswith("/metadata/"):
+            pages = [{"f": f"page{i:04}.tif", "d": [{"w": side >> (4 - zoom), "h": side >> (4 - zoom)}
+                                                     for zoom in range(5)]}
+                     for i in range(options.page_count)]
+            handler.send(source, json.dumps({"pgs": pages, "t_wid": options.tile_size,
+                                             "t_hei": options.tile_size}).encode("utf-8"), "application/json")
+        elif path == "/iip" and "JTL" in query:
+            handler.send_payload(source, self.tile, "image/jpeg")
+        else:
+            return False
+        return True
+
+    def handle_shpl(self, handler, source, path, query):
+        if path.startswith("/ru/nodes/"):
+            page_data = json.dumps({"pages": [{"id": 1000 + i} for i in range(self.options.page_count)]})
+            handler.send(source, f"<html><head><script>var a = 1;</script><script>var b = 2;</script></head>"
+                                 f"<body><script>init({page_data})</script></body></html>".encode("utf-8"))
+        elif re.fullmatch(r"/pages/\d+/zooms/8", path):
+            handler.send_payload(source, self.jpeg_page, "image/jpeg")
+        else:
+            return False
+        return True
+
+    def handle_kazneb(self, handler, source, path, query):
+        if path.startswith("/ru/bookView/view"):
+            lines = ";\n".join(f'pages.push("/FileStore/dataFiles/bench/{i}.png")'
+                               for i in range(self.options.page_count))
+            handler.send(source, f'<html><body><div id="block-kazneb-content"><script>var pages = [];\n'
+                                 f'{lines};\n</script></div></body></html>'.encode("utf-8"))
+        elif path.startswith("/FileStore/"):
+            handler.send_payload(source, self.png_page, "image/png")
+        else:
+            return False
+        return True
+
+    def handle_rgo(self, handler, source, path, query):
+        if not path.startswith("/safe-view/"):
+            return False
+        try:
+            name = base64.b64decode(path.split("/")[-1].replace("_", "/")).decode("utf-8")
+        except ValueError:
+            return False
+        match = re.fullmatch(r".+/(\d+)", name)
+        if match is None:
+            spans = "".join(f"<span>{n}</span>" for n in ("1", "/", str(self.options.page_count)))
+            handler.send(source, f'<html><body><div class="d-md-flex"></div><div class="d-md-flex"></div>'
+                                 f'<div class="d-md-flex">{spans}</div></body></html>'.encode("utf-8"))
+        elif int(match.group(1)) >= self.options.page_count:
+            handler.send(source, b"Error: no such page", "text/plain")
+        else:
+            handler.send_payload(source, self.png_page, "image/png")
+        return True
+
+    def handle_pgpb(self, handler, source, path, query):
+        if path.startswith("/digitization/document/"):
+            pages = "".join(f'<div class="digitization-view-left" data-id="{i + 1}" data-url="/page/{i + 1}.pdf">'
+                            f'</div>' for i in range(self.options.page_count))
+            handler.send(source, f"<html><body>{pages}</body></html>".encode("utf-8"))
+        elif re.fullmatch(r"/page/\d+\.pdf", path):
+            handler.send_payload(source, self.pdf_page, "application/pdf")
+        else:
+            return False
+        return True
+
+
+def get_rgo_book_url(server, book_id="231378"):
+    encoded_name = base64.b64encode(RGO_BOOK_FILE.encode("utf-8")).decode("utf-8").replace("/", "_")
+    return f"{server.get_url('RGO')}/safe-view/123456789/{book_id}/1/{encoded_name}"
+
+
+if __name__ == "__main__":
+    stand_in = StandInServer().start()
+    print(f"Stand-in libraries at {stand_in.base_url}: " + ", ".join(SOURCE_PREFIXES.values()))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stand_in.stop()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark: how long it takes a fresh interpreter to get the list of sources
+through the lazy registry (downloaders.py) compared with importing every downloader module
+up front, as main_gui.py and main.py used to do.
+
+    python benchmarks/startup_benchmark.py [--runs 10]
+
+Each measurement runs in a new process, so nothing is cached in sys.modules between runs.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+from downloaders import SOURCE_PLUGINS  # noqa: E402
+
+SCENARIOS = {
+    "interpreter only": "pass",
+    "lazy registry": "import downloaders; list(downloaders.SOURCE_PLUGINS)",
+    "command line": "import cli",
+    "eager imports": "; ".join(f"import {plugin.module_name}" for plugin in SOURCE_PLUGINS.values()),
+}
+HEAVY_MODULES = ["selenium", "PIL", "PyPDF2", "bs4", "html5lib", "requests"]
+
+
+def measure(code):
+    """
+    @return: wall time in seconds and the heavy modules loaded, or None and the error text
+    """
+    probe = code + "; import sys; print(','.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", probe], cwd=REPO_FOLDER, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        return None, process.stderr.strip().splitlines()[-1]
+    return elapsed, process.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<16} {'median, ms':>10} {'min, ms':>8}  heavy modules loaded")
+    for name, code in SCENARIOS.items():
+        timings = []
+        details = ""
+        for _ in range(args.runs):
+            elapsed, details = measure(code)
+            if elapsed is None:
+                break
+            timings.append(elapsed)
+        if not timings:
+            print(f"{name:<16} {'n/a':>10} {'n/a':>8}  failed: {details}")
+            continue
+        print(f"{name:<16} {statistics.median(timings) * 1000:>10.1f} {min(timings) * 1000:>8.1f}  {details or '-'}")
+
+
+if __name__ == "__main__":
+    main()
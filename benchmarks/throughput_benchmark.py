@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: downloads a book from each stand-in library (benchmarks/stand_in_servers.py)
+end to end with the real downloader classes, and reports pages/s, bytes/s, peak RSS and CPU time.
+
+    python benchmarks/throughput_benchmark.py [--sources SHPL PRLIB] [--pages 40] [--latency 0.05]
+                                              [--rate-429 0.05] [--page-kb 300] [--runs 3] [--json results.json]
+
+Every download runs in a new process, so that peak RSS and CPU time belong to that download only
+(CPU time includes the worker processes of the download, e.g. PRLIB stitching). The pauses between
+requests are switched off in the configuration unless --pause is given, and the page cache is disabled.
+"""
+
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_in_servers import SOURCE_PREFIXES, StandInOptions, StandInServer, get_rgo_book_url  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+BOOK_ID = "1"
+
+
+def make_downloader_class(source, source_url):
+    """
+    @return: the downloader class of the source with its URLs pointing to the stand-in
+    """
+    if source == "PRLIB":
+        from prlib_downloader import PRlibDownloader
+        return type("StandInPRlibDownloader", (PRlibDownloader,), {
+            "BOOK_URL": source_url + "/item/",
+            "METADATA_URL": source_url + "/metadata/{book_name}/{book_second_name}/{book_name}.json",
+            "TILE_URL": source_url + "/iip?FIF={book_name}/{book_second_name}/{page_name}&JTL={zoom},{tile_num}",
+        })
+    if source == "SHPL":
+        from shpl_downloader import SHPLDownloader
+        return type("StandInSHPLDownloader", (SHPLDownloader,), {
+            "SHPL_URL": source_url + "/ru/nodes/",
+            "SHPL_PAGE_URL": source_url + "/pages/",
+        })
+    if source == "KAZNEB":
+        from kazneb_downloader import KAZNEBDownloader
+        return type("StandInKAZNEBDownloader", (KAZNEBDownloader,), {
+            "BOOK_URL": source_url + "/ru/bookView/view?brId=%s&simple=true",
+            "PAGE_URL": source_url + "/FileStore",
+        })
+    if source == "RGO":
+        from rgo_downloader import RGODownloader
+        return RGODownloader
+    if source == "PGPB":
+        from pgpb_downloader import PGPBDownloader
+        return type("StandInPGPBDownloader", (PGPBDownloader,), {"PGPB_URL": source_url})
+    raise ValueError(f"No stand-in for {source}")
+
+
+def run_download(source, source_url, book_id, folder, options, results):
+    """
+    Runs in a separate process: download one book and put its measurements into results
+    """
+    config = configparser.ConfigParser()
+    config.add_section(source)
+    config[source]["folder"] = folder
+    config[source]["cache"] = "no"
+    for name, value in options.items():
+        config[source][name] = str(value)
+    downloader = make_downloader_class(source, source_url)(config)
+    start_time = time.perf_counter()
+    start_cpu = os.times()
+    error_text, _ = downloader.download_book(book_id, queue.Queue())
+    wall_time = time.perf_counter() - start_time
+    end_cpu = os.times()
+    cpu_time = (end_cpu.user + end_cpu.system + end_cpu.children_user + end_cpu.children_system -
+                start_cpu.user - start_cpu.system - start_cpu.children_user - start_cpu.children_system)
+    peak_rss = None
+    if resource is not None:
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # kilobytes on Linux, bytes on macOS
+        peak_rss = peak_rss if sys.platform == "darwin" else peak_rss * 1024
+    results.put({"error": error_text, "wall_time": wall_time, "cpu_time": cpu_time, "peak_rss": peak_rss})
+
+
+def measure(server, source, options, work_folder):
+    """
+    @return: measurements of one download of the source
+    """
+    book_id = get_rgo_book_url(server) if source == "RGO" else BOOK_ID
+    folder = tempfile.mkdtemp(dir=work_folder)
+    server.reset_counters()
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_download,
+                              args=(source, server.get_url(source), book_id, folder, options, results))
+    process.start()
+    try:
+        result = results.get()
+    finally:
+        process.join()
+        shutil.rmtree(folder, ignore_errors=True)
+    counter = server.counters[source]
+    result.update(requests=counter["requests"], bytes=counter["bytes"], rejected=counter["rejected"])
+    return result
+
+
+def format_size(size):
+    if size is None:
+        return "n/a"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCE_PREFIXES), default=list(SOURCE_PREFIXES))
+    parser.add_argument("--pages", type=int, default=20, help="pages per book")
+    parser.add_argument("--page-kb", type=int, default=200, help="approximate size of a page image")
+    parser.add_argument("--tiles-per-side", type=int, default=4, help="PRLIB page size in 256 px tiles")
+    parser.add_argument("--latency", type=float, default=0.02, help="server latency of a page request, seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of page requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After of the 429 answers, seconds")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--pool-size", type=int, help="maximum parallel connections to one host")
+    parser.add_argument("--pause", type=float, default=0, help="initial pause between requests, seconds")
+    parser.add_argument("--min-pause", type=float, default=0, help="minimal pause between requests, seconds")
+    parser.add_argument("--json", help="also write the results to this file, to compare runs later")
+    args = parser.parse_args()
+
+    options = {"pause": args.pause, "min_pause": args.min_pause}
+    if args.pool_size:
+        options["pool_size"] = args.pool_size
+    server = StandInServer(StandInOptions(page_count=args.pages, page_size=args.page_kb * 1024,
+                                          latency_sec=args.latency, rate_429=args.rate_429,
+                                          retry_after_sec=args.retry_after,
+                                          tiles_per_side=args.tiles_per_side)).start()
+    all_results = {}
+    print(f"{'source':<8} {'pages/s':>8} {'MB/s':>7} {'wall, s':>8} {'CPU, s':>7} {'peak RSS':>9} "
+          f"{'requests':>8} {'429':>5}  errors")
+    with tempfile.TemporaryDirectory() as work_folder:
+        try:
+            for source in args.sources:
+                runs = [measure(server, source, options, work_folder) for _ in range(args.runs)]
+                all_results[source] = runs
+                wall_time = statistics.median(run["wall_time"] for run in runs)
+                cpu_time = statistics.median(run["cpu_time"] for run in runs)
+                transferred = statistics.median(run["bytes"] for run in runs)
+                peak_rss = max((run["peak_rss"] for run in runs if run["peak_rss"] is not None), default=None)
+                errors = "; ".join(sorted({run["error"] for run in runs if run["error"]})) or "-"
+                print(f"{source:<8} {args.pages / wall_time:>8.1f} {transferred / wall_time / (1024 * 1024):>7.2f} "
+                      f"{wall_time:>8.2f} {cpu_time:>7.2f} {format_size(peak_rss):>9} "
+                      f"{runs[0]['requests']:>8} {runs[0]['rejected']:>5}  {errors}")
+        finally:
+            server.stop()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fout:
+            json.dump({"settings": vars(args), "results": all_results}, fout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
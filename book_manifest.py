@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+class BookManifest:
+    """
+    Remembers which pages of a book are already saved in its folder, so that a restarted download
+    skips them. A page counts as done only if its file still has the recorded size and checksum
+    """
+    MANIFEST_FILE = "manifest.json"
+    BOOK_KEY = "book"
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.filename = os.path.join(folder, self.MANIFEST_FILE)
+        self.pages = dict()
+        self.lock = threading.Lock()
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, encoding="utf-8") as fin:
+                    self.pages = json.load(fin)["pages"]
+            except (ValueError, KeyError) as e:
+                logging.error(f"Ignoring broken manifest {self.filename}: {e}")
+
+    def is_done(self, page_key):
+        with self.lock:
+            entry = self.pages.get(str(page_key))
+        if entry is None:
+            return False
+        filename = os.path.join(self.folder, entry["file"])
+        if not os.path.exists(filename) or os.path.getsize(filename) != entry["size"]:
+            return False
+        return self.file_checksum(filename) == entry["sha256"]
+
+    def add(self, page_key, filename, checksum=None):
+        if checksum is None:
+            checksum = self.file_checksum(filename)
+        entry = {"file": os.path.relpath(filename, self.folder),
+                 "size": os.path.getsize(filename),
+                 "sha256": checksum}
+        with self.lock:
+            self.pages[str(page_key)] = entry
+            self.save()
+
+    def get_file(self, page_key):
+        """
+        @return: the file the page is saved in now (recompression may have replaced the downloaded one) or None
+        """
+        with self.lock:
+            entry = self.pages.get(str(page_key))
+        if entry is None:
+            return None
+        return os.path.join(self.folder, entry["file"])
+
+    def get_recompressed_file(self, filename):
+        """
+        @return: the file that replaced filename after recompression (or filename itself if it is
+        such a file already) or None
+        """
+        relative_filename = os.path.relpath(filename, self.folder)
+        with self.lock:
+            for entry in self.pages.values():
+                if "original_file" in entry and relative_filename in (entry["original_file"], entry["file"]):
+                    return os.path.join(self.folder, entry["file"])
+        return None
+
+    def replace_file(self, filename, new_filename, checksum):
+        """
+        Point the page saved as filename to its recompressed copy, keeping the original size
+        """
+        relative_filename = os.path.relpath(filename, self.folder)
+        with self.lock:
+            for entry in self.pages.values():
+                if entry["file"] == relative_filename:
+                    entry["original_file"] = relative_filename
+                    entry["original_size"] = entry["size"]
+                    entry["file"] = os.path.relpath(new_filename, self.folder)
+                    entry["size"] = os.path.getsize(new_filename)
+                    entry["sha256"] = checksum
+                    self.save()
+                    return
+
+    def get_savings(self):
+        """
+        @return: bytes saved by recompression over the whole book
+        """
+        with self.lock:
+            return sum(entry["original_size"] - entry["size"] for entry in self.pages.values()
+                       if "original_size" in entry)
+
+    def save(self):
+        temporary_filename = self.filename + ".part"
+        with open(temporary_filename, "w", encoding="utf-8") as fout:
+            json.dump({"pages": self.pages}, fout, ensure_ascii=False, indent=1)
+        os.replace(temporary_filename, self.filename)
+
+    @classmethod
+    def file_checksum(cls, filename):
+        checksum = hashlib.sha256()
+        with open(filename, "rb") as fin:
+            for chunk in iter(lambda: fin.read(cls.CHUNK_SIZE), b""):
+                checksum.update(chunk)
+        return checksum.hexdigest()
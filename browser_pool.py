@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+
+
+def create_headless_chrome(arguments=(), prefs=None):
+    options = webdriver.ChromeOptions()
+    if prefs:
+        options.add_experimental_option("prefs", prefs)
+    options.add_argument("--disable-features=VizDisplayCompositor")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--headless")
+    options.add_argument("--window-position=-10000,-10000")
+    for argument in arguments:
+        options.add_argument(argument)
+    driver = webdriver.Chrome(options=options)
+    logging.info("Initialized driver")
+    return driver
+
+
+class PooledBrowser:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        # set by the downloader once the browser has a logged in session of its library
+        self.logged_in = False
+
+
+class BrowserPool:
+    """
+    Keeps started headless Chrome instances between books, one set per library and login, so that
+    a book does not pay for the browser start and the login again. A browser is closed after
+    MAX_USES books, when its page memory grows over MAX_HEAP_MB or when a book using it failed
+    """
+    MAX_USES = 20
+    MAX_HEAP_MB = 1024
+
+    def __init__(self):
+        self.idle_browsers = dict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, key, create_driver):
+        """
+        @param key: what makes browsers interchangeable, e.g. (section, login)
+        @param create_driver: function starting a new browser
+        """
+        with self.lock:
+            idle = self.idle_browsers.get(key, [])
+            browser = idle.pop() if idle else None
+        if browser is None:
+            browser = PooledBrowser(create_driver())
+        else:
+            logging.info(f"Reusing browser for {key[0]}")
+        browser.uses += 1
+        completed = False
+        try:
+            yield browser
+            completed = True
+        finally:
+            if completed and not self.needs_recycling(browser):
+                with self.lock:
+                    self.idle_browsers.setdefault(key, []).append(browser)
+            else:
+                self.quit(browser)
+
+    def needs_recycling(self, browser):
+        if browser.uses >= self.MAX_USES:
+            return True
+        try:
+            heap_size = browser.driver.execute_script(
+                "return window.performance.memory ? window.performance.memory.usedJSHeapSize : 0;")
+        except Exception as e:
+            logging.error(f"Browser does not respond: {e}")
+            return True
+        return heap_size > self.MAX_HEAP_MB * 1024 * 1024
+
+    @staticmethod
+    def quit(browser):
+        try:
+            browser.driver.quit()
+            logging.info("Closed driver")
+        except Exception as e:
+            logging.error(f"Exception closing driver {e}")
+
+    def close_all(self):
+        with self.lock:
+            browsers = [browser for idle in self.idle_browsers.values() for browser in idle]
+            self.idle_browsers.clear()
+        for browser in browsers:
+            self.quit(browser)
+
+
+BROWSER_POOL = BrowserPool()
+atexit.register(BROWSER_POOL.close_all)
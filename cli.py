@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+elib_downloader — command line interface for scripted and scheduled (cron) runs.
+
+Progress is printed to stdout as JSON lines, log messages go to stderr.
+
+    python cli.py --source SHPL 5006468 5006470
+    python cli.py --source PRLIB --ids-file books.txt --folder /data/books --min-pause 0.1
+    python cli.py --source KAZNEB --output pdf 1543925
+    python cli.py --jobs-file jobs.json
+
+Lines of an ids file hold a book id, optionally preceded by a source ("KAZNEB 1543925").
+Logins, passwords and per-source options are read from config.ini.
+"""
+
+import argparse
+import configparser
+import json
+import multiprocessing
+import sys
+import time
+
+from batch_queue import BatchScheduler, JobQueue
+from downloaders import DOWNLOAD_FUNCTIONS
+from output_formats import OUTPUT_FORMATS, RECOMPRESS_METHODS
+
+CONFIG_FILE = "config.ini"
+POLL_INTERVAL_SEC = 0.5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download books from electronic libraries")
+    parser.add_argument("book_ids", nargs="*", help="book ids (or full links, depending on the source)")
+    parser.add_argument("--source", choices=list(DOWNLOAD_FUNCTIONS), help="library of the books")
+    parser.add_argument("--ids-file", help="file with one book id per line, optionally preceded by a source")
+    parser.add_argument("--folder", help="folder for the books (default: folder from config.ini or .)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="configuration file with logins and passwords")
+    parser.add_argument("--jobs-file", help="keep the job list in this file to continue it in the next run "
+                                            "(with no book ids, only the unfinished jobs of the list are run)")
+    parser.add_argument("--parallel-books", type=int, default=BatchScheduler.MAX_PARALLEL_JOBS,
+                        help="how many books of different libraries are downloaded at the same time")
+    parser.add_argument("--pool-size", type=int, help="maximum parallel connections to one host")
+    parser.add_argument("--pause", type=float, help="initial pause between requests to one host, seconds")
+    parser.add_argument("--min-pause", type=float, help="minimal pause between requests to one host, seconds")
+    parser.add_argument("--output", choices=OUTPUT_FORMATS,
+                        help="collect the page images into a PDF, CBZ or ZIP file next to the book folder")
+    parser.add_argument("--recompress", choices=RECOMPRESS_METHODS,
+                        help="save PNG pages again as optimized PNG, lossless WebP/JPEG XL or JPEG")
+    parser.add_argument("--jpeg-quality", type=int, help="quality for --recompress jpeg (default 90)")
+    args = parser.parse_args(argv)
+    if not args.book_ids and not args.ids_file and not args.jobs_file:
+        parser.error("specify book ids, --ids-file or --jobs-file")
+    if args.book_ids and not args.source:
+        parser.error("--source is required for book ids given on the command line")
+    return args
+
+
+def read_books(args):
+    books = [(args.source, book_id) for book_id in args.book_ids]
+    if args.ids_file:
+        with open(args.ids_file, encoding="utf-8") as fin:
+            for line in fin:
+                parts = line.split()
+                if not parts or parts[0].startswith("#"):
+                    continue
+                if len(parts) == 1:
+                    if not args.source:
+                        raise ValueError(f"No source for {parts[0]}, use --source or the 'SOURCE ID' format")
+                    books.append((args.source, parts[0]))
+                else:
+                    books.append((parts[0].upper(), parts[1]))
+    for source, book_id in books:
+        if source not in DOWNLOAD_FUNCTIONS:
+            raise ValueError(f"Unknown source {source} for {book_id}")
+    return books
+
+
+def make_config_factory(args):
+    options = {"pool_size": args.pool_size, "pause": args.pause, "min_pause": args.min_pause, "output": args.output,
+               "recompress": args.recompress, "jpeg_quality": args.jpeg_quality}
+
+    def config_factory(job):
+        config = configparser.ConfigParser()
+        config.read(args.config, encoding="utf-8")
+        if not config.has_section(job.source):
+            config.add_section(job.source)
+        # a job of an earlier run keeps the folder it was given then
+        if job.folder:
+            config[job.source]["folder"] = job.folder
+        for name, value in options.items():
+            if value is not None:
+                config[job.source][name] = str(value)
+        return config
+
+    return config_factory
+
+
+def print_event(event):
+    sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        books = read_books(args)
+    except (OSError, ValueError) as e:
+        print_event({"event": "error", "message": str(e)})
+        return 2
+
+    job_queue = JobQueue(args.jobs_file)
+    for source, book_id in books:
+        job = job_queue.find(source, book_id, args.folder)
+        if job is None:
+            job_queue.add(source, book_id, args.folder)
+        elif job.status == job.STATUS_FAILED:
+            job_queue.update(job, status=job.STATUS_QUEUED, progress=0.0, message="")
+    # books finished in earlier runs of the job list are neither downloaded nor reported again
+    run_job_ids = {job.job_id for job in job_queue.get_jobs() if not job.is_finished()}
+    scheduler = BatchScheduler(job_queue, DOWNLOAD_FUNCTIONS, make_config_factory(args), args.parallel_books)
+    scheduler.start()
+
+    reported = dict()
+    while True:
+        jobs = [job for job in job_queue.get_jobs() if job.job_id in run_job_ids]
+        for job in jobs:
+            state = (job.status, job.event)
+            if reported.get(job.job_id) != state:
+                reported[job.job_id] = state
+                event = {"event": "job", "source": job.source, "book_id": job.book_id,
+                         "status": job.status, "progress": round(job.progress, 4), "message": job.message}
+                if job.event is not None and not job.is_finished():
+                    # stage, done, total, bytes_done, bytes_total, rate, bytes_rate, eta_sec
+                    event.update(job.event)
+                print_event(event)
+        if all(job.is_finished() for job in jobs):
+            break
+        time.sleep(POLL_INTERVAL_SEC)
+
+    failed = [job for job in jobs if job.status != job.STATUS_DONE]
+    print_event({"event": "finished", "books": len(jobs), "failed": len(failed)})
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+"""
+Registry of the supported sources. A downloader module, and with it its heavy dependencies
+(selenium, PIL, PyPDF2...), is imported only when a book of that source is downloaded
+"""
+__author__ = "gisly"
+
+import importlib
+
+
+class SourcePlugin:
+    def __init__(self, name, module_name, class_name, needs_auth, hint, book_id_in_constructor=False):
+        self.name = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.needs_auth = needs_auth
+        self.hint = hint
+        # PDFReader needs the book link already when starting its browser
+        self.book_id_in_constructor = book_id_in_constructor
+
+    def get_downloader_class(self):
+        return getattr(importlib.import_module(self.module_name), self.class_name)
+
+    def download(self, config, book_id, queue):
+        downloader_class = self.get_downloader_class()
+        if self.book_id_in_constructor:
+            downloader = downloader_class(config, book_id)
+        else:
+            downloader = downloader_class(config)
+        return downloader.download_book(book_id, queue)
+
+
+SOURCE_PLUGINS = {plugin.name: plugin for plugin in [
+    SourcePlugin("NLRS", "nlrs_downloader", "NLRSDownloader", True,
+                 "Для ссылки вида https://e.nlrs.ru/open/1644 укажите 1644"),
+    SourcePlugin("RGO", "rgo_downloader", "RGODownloader", False,
+                 "Укажите полную ссылку, например\nhttps://elib.rgo.ru/safe-view/123456789/231378/1/..."),
+    SourcePlugin("PRLIB", "prlib_downloader", "PRlibDownloader", False,
+                 "Для ссылки вида https://www.prlib.ru/item/680723 укажите 680723"),
+    SourcePlugin("PGPB", "pgpb_downloader", "PGPBDownloader", False,
+                 "Для ссылки вида https://pgpb.ru/digitization/document/4375 укажите 4375"),
+    SourcePlugin("SHPL", "shpl_downloader", "SHPLDownloader", False,
+                 "Для ссылки вида http://elib.shpl.ru/pages/5006468/ укажите 5006468"),
+    SourcePlugin("PDF_READER", "pdfreader_downloader", "PDFReaderDownloader", False,
+                 "Укажите полную ссылку, например\nhttp://62.249.142.211:8083/read/88/pdf",
+                 book_id_in_constructor=True),
+    SourcePlugin("LIBFL", "libfl_downloader", "LIBFLDownloader", True,
+                 "Укажите ID книги или заказа, например\nbookID=BJVVV_604652 ЛИБО OrderId=920010"),
+    SourcePlugin("NEBCHR", "nebchr_downloader", "NEBCHRDownloader", True,
+                 "Укажите ID книги, например 3041"),
+    SourcePlugin("KAZNEB", "kazneb_downloader", "KAZNEBDownloader", False,
+                 "Для ссылки вида https://kazneb.kz/ru/catalogue/view/1543925\nукажите 1543925"),
+]}
+
+DOWNLOAD_FUNCTIONS = {name: plugin.download for name, plugin in SOURCE_PLUGINS.items()}
@@ -4,6 +4,19 @@ import os, importlib
 # Locate customtkinter package for bundling its assets
 ctk_path = os.path.dirname(importlib.import_module("customtkinter").__file__)
 
+# downloaders.py imports these by name only when a source is used, so PyInstaller cannot see them
+downloader_modules = [
+    'nlrs_downloader',
+    'rgo_downloader',
+    'prlib_downloader',
+    'pgpb_downloader',
+    'shpl_downloader',
+    'pdfreader_downloader',
+    'libfl_downloader',
+    'nebchr_downloader',
+    'kazneb_downloader',
+]
+
 a = Analysis(
     ['main_gui.py'],
     pathex=[],
@@ -15,7 +28,7 @@ a = Analysis(
         'customtkinter',
         'PIL',
         'PIL._tkinter_finder',
-    ],
+    ] + downloader_modules,
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+REQUEST_PHASES = ("dns", "connect", "tls", "ttfb", "transfer")
+
+# timing of the request made by the current thread, filled in by the connection classes below
+current_request = threading.local()
+
+
+class RequestTiming:
+    def __init__(self, host):
+        self.host = host
+        self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.new_connection = False
+        self.start_time = time.perf_counter()
+        # when the connection was ready for the request (the async client only)
+        self.connected_time = None
+        self.response_time = None
+
+
+def add_phase(name, seconds):
+    timing = getattr(current_request, "timing", None)
+    if timing is not None:
+        timing.phases[name] += seconds
+
+
+class TimedConnectionMixin:
+    """
+    Measures name resolution, TCP connect, TLS handshake and time to the response headers
+    of the connections opened by requests.
+    _new_conn and _dns_host are not public API of urllib3: they are checked against urllib3 2.x,
+    the range pinned in requirements.txt (tests/test_instrumentation.py fails if they change)
+    """
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        host = self._dns_host
+        try:
+            address = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # urllib3 resolves the name again and reports the error its own way
+            address = None
+        resolved = time.perf_counter()
+        add_phase("dns", resolved - start)
+        try:
+            if address is not None:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError:
+                    # the first address did not answer, let urllib3 try all of them
+                    self._dns_host = host
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+            add_phase("connect", time.perf_counter() - resolved)
+
+    def connect(self):
+        timing = getattr(current_request, "timing", None)
+        before = timing.phases["dns"] + timing.phases["connect"] if timing is not None else 0
+        start = time.perf_counter()
+        super().connect()
+        if timing is not None:
+            timing.new_connection = True
+            socket_time = timing.phases["dns"] + timing.phases["connect"] - before
+            timing.phases["tls"] += max(time.perf_counter() - start - socket_time, 0)
+
+    def getresponse(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        timing = getattr(current_request, "timing", None)
+        if timing is not None:
+            timing.response_time = time.perf_counter()
+            timing.phases["ttfb"] += timing.response_time - start
+        return response
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                   "https": TimedHTTPSConnectionPool}
+
+
+def timed_call(function, *args):
+    """
+    Run function in a worker and measure it there
+    @return: result of the function and seconds it took
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class BookInstrumentation:
+    """
+    Where the time of a book goes: per host request phases, bytes and status codes, retries,
+    pauses of the rate limiter and CPU stages (stitching, compression, packaging).
+    Times of requests, pauses and stages are summed over all threads and worker processes,
+    so together they can exceed the wall time of the book
+    """
+    METRICS_FILE = "metrics.json"
+    PROMETHEUS_FILE = "metrics.prom"
+
+    def __init__(self, section):
+        self.section = section
+        self.book_id = None
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        start_cpu = os.times()
+        self.start_cpu_time = start_cpu.user + start_cpu.system
+        self.hosts = dict()
+        self.pause_time = 0.0
+        self.retries = 0
+        self.hedges = 0
+        self.stages = dict()
+
+    def start_request(self, url):
+        timing = RequestTiming(urlsplit(url).netloc)
+        current_request.timing = timing
+        return timing
+
+    def finish_request(self, timing, status_code, size):
+        """
+        @param size: bytes of the response body or None for streamed responses, counted by add_transfer
+        """
+        end_time = time.perf_counter()
+        current_request.timing = None
+        if size is not None and timing.response_time is not None:
+            timing.phases["transfer"] += end_time - timing.response_time
+        with self.lock:
+            host = self.get_host(timing.host)
+            host["requests"] += 1
+            host["new_connections"] += int(timing.new_connection)
+            host["bytes"] += size or 0
+            host["request_time"] += end_time - timing.start_time
+            host["max_request_time"] = max(host["max_request_time"], end_time - timing.start_time)
+            for phase, seconds in timing.phases.items():
+                host["phases"][phase] += seconds
+            status = str(status_code)
+            host["status_codes"][status] = host["status_codes"].get(status, 0) + 1
+
+    def add_transfer(self, url, seconds, size):
+        with self.lock:
+            host = self.get_host(urlsplit(url).netloc)
+            host["phases"]["transfer"] += seconds
+            host["request_time"] += seconds
+            host["bytes"] += size
+
+    def get_host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {"requests": 0, "new_connections": 0, "bytes": 0, "request_time": 0.0,
+                                "max_request_time": 0.0, "phases": dict.fromkeys(REQUEST_PHASES, 0.0),
+                                "status_codes": dict()}
+        return self.hosts[host]
+
+    def add_pause(self, seconds):
+        with self.lock:
+            self.pause_time += seconds
+
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_hedge(self):
+        with self.lock:
+            self.hedges += 1
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def get_report(self):
+        end_cpu = os.times()
+        with self.lock:
+            return {
+                "section": self.section,
+                "book_id": self.book_id,
+                "wall_time": time.perf_counter() - self.start_time,
+                # the whole process, other books downloaded at the same time included
+                "process_cpu_time": end_cpu.user + end_cpu.system - self.start_cpu_time,
+                "pause_time": self.pause_time,
+                "network_time": sum(host["request_time"] for host in self.hosts.values()),
+                "stages": dict(self.stages),
+                "retries": self.retries,
+                "hedged_requests": self.hedges,
+                "hosts": json.loads(json.dumps(self.hosts)),
+            }
+
+    def log_summary(self, report):
+        stages = ", ".join(f"{name} {seconds:.1f} s" for name, seconds in report["stages"].items()) or "none"
+        logging.info(f"{self.section} {self.book_id}: {report['wall_time']:.1f} s in total, "
+                     f"{report['pause_time']:.1f} s pauses, {report['network_time']:.1f} s requests, "
+                     f"stages: {stages}, {report['retries']} retries, {report['hedged_requests']} hedged requests")
+
+    def save(self, folder, prometheus=False):
+        report = self.get_report()
+        self.log_summary(report)
+        self.write_file(os.path.join(folder, self.METRICS_FILE),
+                        json.dumps(report, ensure_ascii=False, indent=1))
+        if prometheus:
+            self.write_file(os.path.join(folder, self.PROMETHEUS_FILE), self.to_prometheus(report))
+
+    def to_prometheus(self, report):
+        """
+        @return: the report in the Prometheus text format (e.g. for the textfile collector of node_exporter)
+        """
+        book_labels = {"source": self.section, "book": str(self.book_id)}
+        lines = []
+
+        def add_metric(name, metric_type, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in {**book_labels,
+                                                                                          **labels}.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        hosts = report["hosts"]
+        add_metric("elib_book_wall_seconds", "gauge", "Wall time of the book download.",
+                   [({}, report["wall_time"])])
+        add_metric("elib_book_pause_seconds_total", "counter", "Time spent in rate limiter pauses.",
+                   [({}, report["pause_time"])])
+        add_metric("elib_book_retries_total", "counter", "Repeated page requests.", [({}, report["retries"])])
+        add_metric("elib_book_hedged_requests_total", "counter", "Slow requests sent once more.",
+                   [({}, report["hedged_requests"])])
+        add_metric("elib_stage_seconds_total", "counter", "Time spent in CPU stages.",
+                   [({"stage": name}, seconds) for name, seconds in report["stages"].items()])
+        add_metric("elib_requests_total", "counter", "HTTP requests.",
+                   [({"host": name}, host["requests"]) for name, host in hosts.items()])
+        add_metric("elib_new_connections_total", "counter", "Opened connections.",
+                   [({"host": name}, host["new_connections"]) for name, host in hosts.items()])
+        add_metric("elib_response_bytes_total", "counter", "Downloaded bytes.",
+                   [({"host": name}, host["bytes"]) for name, host in hosts.items()])
+        add_metric("elib_request_phase_seconds_total", "counter", "Request time by phase.",
+                   [({"host": name, "phase": phase}, seconds)
+                    for name, host in hosts.items() for phase, seconds in host["phases"].items()])
+        add_metric("elib_responses_total", "counter", "Responses by status code.",
+                   [({"host": name, "code": code}, count)
+                    for name, host in hosts.items() for code, count in host["status_codes"].items()])
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_file(filename, text):
+        temporary_filename = filename + ".part"
+        with open(temporary_filename, "w", encoding="utf-8") as fout:
+            fout.write(text)
+        os.replace(temporary_filename, filename)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
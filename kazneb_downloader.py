@@ -2,16 +2,17 @@
 # -*- coding: utf-8 -*
 __author__ = "gisly"
 
+import asyncio
 import json
 import logging
 import os
 import html
 import re
 
-from abstract_lib_downloader import LibraryDownloader
+from async_lib_downloader import AsyncLibraryDownloader
 
 
-class KAZNEBDownloader(LibraryDownloader):
+class KAZNEBDownloader(AsyncLibraryDownloader):
     BOOK_URL = "https://kazneb.kz/ru/bookView/view?brId=%s&simple=true"
     PAGE_URL = "https://kazneb.kz/FileStore"
     current_section = "KAZNEB"
@@ -29,18 +30,18 @@ class KAZNEBDownloader(LibraryDownloader):
             self.page_from = page_from
             self.create_folders(book_id)
             self.process_book(book_id)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
     def process_book(self, book_id):
         pages = self.extract_page_ids(book_id)
-        total_page_num = len(pages)
-        for i, page in enumerate(pages):
-            self.queue.put_nowait(round(i / total_page_num, 2))
-            self.download_page(page, i)
-            self.make_pause()
+        self.download_page_list(pages, self.download_page)
 
     def extract_page_ids(self, book_id):
         url = self.BOOK_URL % book_id
@@ -49,9 +50,17 @@ class KAZNEBDownloader(LibraryDownloader):
         page_data = main_page.select("#block-kazneb-content")[0].select("script")[0].contents[0].split("= []")[-1].strip().split(";\n")
         return [html.unescape(re.sub("[';()\"]", "", page.split('pages.push("/FileStore')[-1])) for page in page_data if page]
 
-    def download_page(self, page_id, page_num):
+    async def download_page(self, page_id, page_num):
+        """
+        @return: filename of the page
+        """
         page_filename = str(page_num).zfill(5)
-        url = self.PAGE_URL + page_id
         output_filename = os.path.join(self.folder, page_filename) + ".png"
-        self.save_image(url, output_filename)
+        if await asyncio.to_thread(self.manifest.is_done, page_num):
+            logging.info(f"Page {page_num} already downloaded")
+            return self.manifest.get_file(page_num)
+        url = self.PAGE_URL + page_id
+        checksum = await self.save_image_async(url, output_filename, cache_key=f"{self.current_section}:{page_id}")
+        await asyncio.to_thread(self.manifest.add, page_num, output_filename, checksum)
         logging.info(f"Processed page {page_num}")
+        return output_filename
@@ -6,7 +6,9 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('D:\\Elena\\Git\\elib_downloader\\venv\\Lib\\site-packages\\nicegui', 'nicegui')],
-    hiddenimports=[],
+    # downloaders.py imports the downloader modules by name only when a source is used
+    hiddenimports=['nlrs_downloader', 'rgo_downloader', 'prlib_downloader', 'pgpb_downloader', 'shpl_downloader',
+                   'pdfreader_downloader', 'libfl_downloader', 'nebchr_downloader', 'kazneb_downloader'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -1,16 +1,14 @@
-from selenium import webdriver
 import json
 import logging
 import os
 import re
 
-import requests
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
-from tqdm import tqdm
 
-from abstract_lib_downloader import LibraryDownloader
+from abstract_lib_downloader import AuthorizationRequired, LibraryDownloader
+from browser_pool import BROWSER_POOL, create_headless_chrome
 
 
 class LIBFLDownloader(LibraryDownloader):
@@ -22,42 +20,41 @@ class LIBFLDownloader(LibraryDownloader):
         "referer": "https://catalog.libfl.ru/"
     }
     current_section = "LIBFL"
+    driver = None
     queue = None
     page_from = 1
 
     def __init__(self, config):
         self.init_authorized_access(config)
 
-        options = webdriver.ChromeOptions()
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--headless")
-        options.add_argument("--window-position=-10000,-10000")
-        self.driver = webdriver.Chrome(options=options)
-        logging.info("Initialized driver")
-
-    def __del__(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-                logging.info("Closed driver")
-            except Exception as e:
-                logging.error(f"Exception closing driver {e}")
-
     def download_book(self, book_id, queue, page_from=1):
         error_text = None
         try:
             self.queue = queue
             self.create_folders(book_id)
             self.page_from = page_from
-            self.make_pause()
-            self.open_site()
-            self.download_pages(book_id)
+            self.run_authorized(lambda cookies: self.download_pages(book_id, cookies), self.log_in)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
+    def log_in(self):
+        """
+        @return: cookies of the new session
+        """
+        with BROWSER_POOL.lease((self.current_section, self.login), create_headless_chrome) as browser:
+            self.driver = browser.driver
+            self.make_pause()
+            self.open_site()
+            browser.logged_in = True
+            self.make_pause()
+            return self.driver.get_cookies()
+
     def open_site(self):
         self.driver.get(self.URL_LOGIN)
         element_username = self.driver.find_element(by=By.NAME, value="login")
@@ -73,44 +70,45 @@ class LIBFLDownloader(LibraryDownloader):
 
         element_button_ok.click()
 
-    def download_pages(self, book_id):
-        cookies = self.driver.get_cookies()
-        cookies_str = ";".join([c["name"] + "=" + c["value"] for c in cookies])
+    def download_pages(self, book_id, cookies):
+        cookies_str = self.cookies_to_header(cookies)
 
         book_url = self.URL_BOOK % (book_id, self.page_from)
-        self.make_pause()
         match = None
         for i in range(0, 3):
             main_page = self.download_html(book_url, additional_headers={"Cookie": cookies_str, })
-            self.make_pause()
             match = re.search('var exemplar = (\{.+?});',
                               main_page.text, re.S)
             if match:
                 break
 
         if not match:
-            raise Exception(f"Could not start downloading")
+            # the viewer shows no book data without a valid session
+            raise AuthorizationRequired(f"Could not start downloading")
 
         book_data = match.group(1).strip()
         book_data_structured = json.loads(book_data)
         hq = book_data_structured["Path_HQ"]
         jpeg_files = book_data_structured["JPGFiles"]
         self.last_page = len(jpeg_files)
-        n = self.last_page + 1
-
-        for i in tqdm(range(self.page_from, self.last_page + 1)):
-            self.queue.put_nowait(round(i / n, 2))
-            logging.info(f"Downloading page {i} out of {self.last_page}")
-            filename = str(i).zfill(4) + ".jpg"
-            full_filename = os.path.join(self.folder, filename)
-
-            self.make_pause()
-            image_link = self.URL_CDN + hq + jpeg_files [i-1]
-            response = requests.get(image_link, headers=self.HEADERS)
-            if not response.ok:
-                raise Exception(f"Exception when downloading page {i} out of {self.last_page}")
-            with open(full_filename, 'wb') as fout:
-                fout.write(response.content)
-                logging.info(f"Downloaded page {i} out of {self.last_page}")
-            if i >= self.last_page:
-                break
\ No newline at end of file
+        self.download_page_list(list(range(self.page_from, self.last_page + 1)),
+                                lambda i, _: self.download_page(self.URL_CDN + hq + jpeg_files[i - 1], i))
+
+    def download_page(self, image_link, i):
+        """
+        @return: filename of the page
+        """
+        filename = str(i).zfill(4) + ".jpg"
+        full_filename = os.path.join(self.folder, filename)
+        if self.manifest.is_done(i):
+            logging.info(f"Page {i} already downloaded")
+            return full_filename
+        logging.info(f"Downloading page {i} out of {self.last_page}")
+
+        response = self.http_get(image_link, headers=self.HEADERS, stream=True)
+        if not response.ok:
+            raise Exception(f"Exception when downloading page {i} out of {self.last_page}")
+        checksum = self.save_response(response, full_filename)
+        logging.info(f"Downloaded page {i} out of {self.last_page}")
+        self.manifest.add(i, full_filename, checksum)
+        return full_filename
\ No newline at end of file
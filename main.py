@@ -1,24 +1,19 @@
 #!/usr/bin/env python3
 import configparser
 import os.path
-from multiprocessing import Manager, Queue
+from multiprocessing import Manager
 import cairo
 from nicegui import run, ui
 
-from libfl_downloader import LIBFLDownloader
+from downloaders import DOWNLOAD_FUNCTIONS
+from output_formats import OUTPUT_FOLDER, OUTPUT_FORMATS
 from local_file_picker import local_file_picker
-from nebchr_downloader import NEBCHRDownloader
-from nlrs_downloader import NLRSDownloader
-from pdfreader_downloader import PDFReaderDownloader
-from pgpb_downloader import PGPBDownloader
-from prlib_downloader import PRlibDownloader
-from rgo_downloader import RGODownloader
-from shpl_downloader import SHPLDownloader
-from kazneb_downloader import KAZNEBDownloader
+from progress_events import format_event
 
 queue = None
 is_book_download_in_progress = False
 progressbar = None
+progress_label = None
 folder_displayed = None
 spinner = None
 login = None
@@ -26,6 +21,7 @@ password = None
 button_download = None
 button_choose_folder = None
 selector_book_source = None
+selector_output = None
 folder = "."
 
 NLRS = "NLRS"
@@ -40,13 +36,6 @@ KAZNEB = "KAZNEB"
 
 
 async def handle_click():
-    methods = {NLRS: download_nlrs, RGO: download_rgo,
-               PRLIB: download_prlib,
-               PGPB: download_pgpb, SHPL: download_shpl,
-               PDF_READER: download_pdfreader,
-               LIBFL: download_libfl,
-               NEBCHR: download_nebchr,
-               KAZNEB: download_kazneb}
     global is_book_download_in_progress
     global queue
     if is_book_download_in_progress:
@@ -57,13 +46,16 @@ async def handle_click():
     config[source_chosen]["login"] = login.value
     config[source_chosen]["password"] = password.value
     config[source_chosen]["folder"] = folder
+    config[source_chosen]["output"] = selector_output.value
+    progressbar.set_value(0)
+    progress_label.set_text("")
     progressbar.visible = True
     is_book_download_in_progress = True
     button_download.disable()
     button_choose_folder.disable()
     queue = Manager().Queue()
     try:
-        method_chosen = methods[source_chosen]
+        method_chosen = DOWNLOAD_FUNCTIONS[source_chosen]
         error_text, result = await run.cpu_bound(method_chosen, config, book_id.value, queue)
         if error_text:
             ui.notify(f"Произошла ошибка: {error_text}", type="negative", timeout=0, close_button=True)
@@ -101,51 +93,6 @@ async def pick_file() -> None:
     folder_displayed.set_text(folder)
 
 
-def download_nlrs(config, book_id_value, queue: Queue):
-    nlrs_downloader = NLRSDownloader(config)
-    return nlrs_downloader.download_book(book_id_value, queue)
-
-
-def download_rgo(config, book_id_value, queue: Queue):
-    rgo_downloader = RGODownloader(config)
-    return rgo_downloader.download_book(book_id_value, queue)
-
-
-def download_prlib(config, book_id_value, queue: Queue):
-    prlib_downloader = PRlibDownloader(config)
-    return prlib_downloader.download_book(book_id_value, queue)
-
-
-def download_pgpb(config, book_id_value, queue: Queue):
-    pgpb_downloader = PGPBDownloader(config)
-    return pgpb_downloader.download_book(book_id_value, queue)
-
-
-def download_shpl(config, book_id_value, queue: Queue):
-    shpl_downloader = SHPLDownloader(config)
-    return shpl_downloader.download_book(book_id_value, queue)
-
-
-def download_pdfreader(config, book_id_value, queue: Queue):
-    pdfreader_downloader = PDFReaderDownloader(config, book_id_value)
-    return pdfreader_downloader.download_book(book_id_value, queue)
-
-
-def download_libfl(config, book_id_value, queue: Queue):
-    libfl_downloader = LIBFLDownloader(config)
-    return libfl_downloader.download_book(book_id_value, queue)
-
-
-def download_nebchr(config, book_id_value, queue: Queue):
-    nebchr_downloader = NEBCHRDownloader(config)
-    return nebchr_downloader.download_book(book_id_value, queue)
-
-
-def download_kazneb(config, book_id_value, queue: Queue):
-    kazneb_downloader = KAZNEBDownloader(config)
-    return kazneb_downloader.download_book(book_id_value, queue)
-
-
 def draw(surface: cairo.Surface) -> None:
     context = cairo.Context(surface)
     context.select_font_face("Arial", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
@@ -158,9 +105,16 @@ def draw(surface: cairo.Surface) -> None:
         context.show_text(password.value)
 
 
-def process_timer(progressbar, spinner, queue):
+def process_timer(progressbar, progress_label, spinner, queue):
     global is_book_download_in_progress
-    progressbar.set_value(queue.get() if queue and not queue.empty() else progressbar.value)
+    event = None
+    while queue and not queue.empty():
+        # only the latest event matters
+        event = queue.get()
+    if event is not None:
+        progressbar.set_value(event.fraction)
+        progress_label.set_text(format_event(event))
+    progress_label.visible = progressbar.visible
     if is_book_download_in_progress:
         spinner.visible = True
     else:
@@ -176,9 +130,11 @@ def main_page():
     global button_download
     global button_choose_folder
     global progressbar
+    global progress_label
     global spinner
     global folder_displayed
     global selector_book_source
+    global selector_output
     queue = Manager().Queue()
     ui.page_title("LibDownloader")
 
@@ -189,6 +145,7 @@ def main_page():
             login = ui.input("Логин", placeholder="Логин (емейл)", on_change=process_text_fields)
             password = ui.input("Пароль", placeholder="Пароль", on_change=process_text_fields)
             book_id = ui.input("Идентификатор книги", placeholder="Идентификатор книги", on_change=process_text_fields)
+            selector_output = ui.select(OUTPUT_FORMATS, value=OUTPUT_FOLDER, label="Результат")
         with ui.column():
             button_download = ui.button("Скачать книгу", on_click=lambda: handle_click())
             button_download.disable()
@@ -259,8 +216,10 @@ def main_page():
             spinner.visible = False
             progressbar = ui.linear_progress(value=0, show_value=False).props("instant-feedback")
             progressbar.visible = False
+            progress_label = ui.label("")
+            progress_label.visible = False
             ui.timer(0.1,
-                     callback=lambda: process_timer(progressbar, spinner, queue))
+                     callback=lambda: process_timer(progressbar, progress_label, spinner, queue))
 
 
 ui.run(native=True, reconnect_timeout=0, window_size=(1500, 500))
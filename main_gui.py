@@ -8,50 +8,27 @@ All backend downloaders remain unchanged.
 import configparser
 import multiprocessing
 import os
-import queue
-import threading
 from tkinter import filedialog
 
 import customtkinter as ctk
 
-# ---------------------------------------------------------------------------
-# Backend imports (unchanged)
-# ---------------------------------------------------------------------------
-from libfl_downloader import LIBFLDownloader
-from nebchr_downloader import NEBCHRDownloader
-from nlrs_downloader import NLRSDownloader
-from pdfreader_downloader import PDFReaderDownloader
-from pgpb_downloader import PGPBDownloader
-from prlib_downloader import PRlibDownloader
-from rgo_downloader import RGODownloader
-from shpl_downloader import SHPLDownloader
-from kazneb_downloader import KAZNEBDownloader
+from batch_queue import BatchJob, BatchScheduler, JobQueue
+from downloaders import DOWNLOAD_FUNCTIONS, SOURCE_PLUGINS
+from output_formats import OUTPUT_CBZ, OUTPUT_FOLDER, OUTPUT_PDF, OUTPUT_ZIP
+from progress_events import ProgressEvent, format_event
 
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
-SOURCES = {
-    "NLRS":       {"needs_auth": True,  "hint": "Для ссылки вида https://e.nlrs.ru/open/1644 укажите 1644"},
-    "RGO":        {"needs_auth": False, "hint": "Укажите полную ссылку, например\nhttps://elib.rgo.ru/safe-view/123456789/231378/1/..."},
-    "PRLIB":      {"needs_auth": False, "hint": "Для ссылки вида https://www.prlib.ru/item/680723 укажите 680723"},
-    "PGPB":       {"needs_auth": False, "hint": "Для ссылки вида https://pgpb.ru/digitization/document/4375 укажите 4375"},
-    "SHPL":       {"needs_auth": False, "hint": "Для ссылки вида http://elib.shpl.ru/pages/5006468/ укажите 5006468"},
-    "PDF_READER": {"needs_auth": False, "hint": "Укажите полную ссылку, например\nhttp://62.249.142.211:8083/read/88/pdf"},
-    "LIBFL":      {"needs_auth": True,  "hint": "Укажите ID книги или заказа, например\nbookID=BJVVV_604652 ЛИБО OrderId=920010"},
-    "NEBCHR":     {"needs_auth": True,  "hint": "Укажите ID книги, например 3041"},
-    "KAZNEB":     {"needs_auth": False, "hint": "Для ссылки вида https://kazneb.kz/ru/catalogue/view/1543925\nукажите 1543925"},
-}
-
-DOWNLOAD_FUNCTIONS = {
-    "NLRS":       lambda cfg, bid, q: NLRSDownloader(cfg).download_book(bid, q),
-    "RGO":        lambda cfg, bid, q: RGODownloader(cfg).download_book(bid, q),
-    "PRLIB":      lambda cfg, bid, q: PRlibDownloader(cfg).download_book(bid, q),
-    "PGPB":       lambda cfg, bid, q: PGPBDownloader(cfg).download_book(bid, q),
-    "SHPL":       lambda cfg, bid, q: SHPLDownloader(cfg).download_book(bid, q),
-    "PDF_READER": lambda cfg, bid, q: PDFReaderDownloader(cfg, bid).download_book(bid, q),
-    "LIBFL":      lambda cfg, bid, q: LIBFLDownloader(cfg).download_book(bid, q),
-    "NEBCHR":     lambda cfg, bid, q: NEBCHRDownloader(cfg).download_book(bid, q),
-    "KAZNEB":     lambda cfg, bid, q: KAZNEBDownloader(cfg).download_book(bid, q),
+SOURCES = {name: {"needs_auth": plugin.needs_auth, "hint": plugin.hint}
+           for name, plugin in SOURCE_PLUGINS.items()}
+
+# result of a download: the folder with page images, optionally packed into a single file
+OUTPUT_FORMATS = {
+    "Папка с изображениями": OUTPUT_FOLDER,
+    "PDF":                   OUTPUT_PDF,
+    "CBZ":                   OUTPUT_CBZ,
+    "ZIP":                   OUTPUT_ZIP,
 }
 
 # ---------------------------------------------------------------------------
@@ -70,6 +47,13 @@ ERROR          = "#c94444"
 BORDER         = "#ddd7ce"
 DISABLED_BG    = "#e8e4de"
 
+JOB_STATUS_TEXT = {
+    BatchJob.STATUS_QUEUED:  "в очереди",
+    BatchJob.STATUS_RUNNING: "скачивается",
+    BatchJob.STATUS_DONE:    "готово",
+    BatchJob.STATUS_FAILED:  "ошибка",
+}
+
 
 class App(ctk.CTk):
     """Main application window."""
@@ -85,12 +69,16 @@ class App(ctk.CTk):
 
         # State
         self.folder = os.path.abspath(".")
-        self.is_downloading = False
-        self.queue: queue.Queue | None = None
+        # credentials typed in this session, by source; they are never written to the job file
+        self.credentials = {}
+        self.job_queue = JobQueue()
+        self.scheduler = BatchScheduler(self.job_queue, DOWNLOAD_FUNCTIONS, self._job_config)
+        self.job_rows = {}
 
         self._build_ui()
         self._bind_clipboard_shortcuts()
         self._on_source_changed()
+        self.scheduler.start()
         self._poll_progress()
 
     # =======================================================================
@@ -248,10 +236,22 @@ class App(ctk.CTk):
         self.password_entry.pack(fill="x", pady=(0, 10))
 
         # Book ID
-        self._section_label(inner_left, "Идентификатор книги")
+        self._section_label(inner_left, "Идентификатор книги (можно несколько через пробел)")
         self.book_id_entry = self._make_entry(inner_left, "Идентификатор книги")
         self.book_id_entry.pack(fill="x", pady=(0, 16))
 
+        # Output format
+        self._section_label(inner_left, "Результат")
+        self.output_var = ctk.StringVar(value=next(iter(OUTPUT_FORMATS)))
+        ctk.CTkOptionMenu(
+            inner_left, variable=self.output_var,
+            values=list(OUTPUT_FORMATS.keys()),
+            fg_color=BG_INPUT, button_color=ACCENT, button_hover_color=ACCENT_HOVER,
+            dropdown_fg_color=BG_CARD, dropdown_hover_color=BG_INPUT,
+            text_color=FG_TEXT, dropdown_text_color=FG_TEXT,
+            font=ctk.CTkFont(size=14), width=280, corner_radius=8
+        ).pack(anchor="w", pady=(0, 14))
+
         # Folder chooser
         folder_frame = ctk.CTkFrame(inner_left, fg_color="transparent")
         folder_frame.pack(fill="x", pady=(0, 18))
@@ -280,15 +280,6 @@ class App(ctk.CTk):
         )
         self.download_btn.pack(fill="x", pady=(0, 10))
 
-        # Progress bar
-        self.progress_bar = ctk.CTkProgressBar(
-            inner_left, progress_color=ACCENT, fg_color=BG_INPUT,
-            height=6, corner_radius=3
-        )
-        self.progress_bar.set(0)
-        self.progress_bar.pack(fill="x", pady=(0, 6))
-        self.progress_bar.pack_forget()  # hidden initially
-
         # Status label
         self.status_label = ctk.CTkLabel(
             inner_left, text="", font=ctk.CTkFont(size=12),
@@ -296,21 +287,38 @@ class App(ctk.CTk):
         )
         self.status_label.pack(fill="x")
 
-        # ===== RIGHT COLUMN — help / source info =====
+        # ===== RIGHT COLUMN — job queue / help =====
         right = ctk.CTkFrame(body, fg_color=BG_CARD, corner_radius=14, border_width=1, border_color=BORDER)
         right.grid(row=0, column=1, sticky="nsew", padx=(8, 0))
 
-        inner_right = ctk.CTkFrame(right, fg_color="transparent")
-        inner_right.pack(fill="both", expand=True, padx=24, pady=24)
+        self.tabs = ctk.CTkTabview(
+            right, fg_color="transparent",
+            segmented_button_selected_color=ACCENT, segmented_button_selected_hover_color=ACCENT_HOVER,
+            segmented_button_unselected_color=BG_INPUT, segmented_button_fg_color=BG_INPUT,
+            text_color=FG_TEXT
+        )
+        self.tabs.pack(fill="both", expand=True, padx=14, pady=(4, 14))
+        queue_tab = self.tabs.add("Очередь")
+        help_tab = self.tabs.add("Справка")
 
-        ctk.CTkLabel(
-            inner_right, text="Справка по источникам",
-            font=ctk.CTkFont(size=16, weight="bold"), text_color=FG_TEXT
-        ).pack(anchor="w", pady=(0, 14))
+        # Job list
+        self.jobs_frame = ctk.CTkScrollableFrame(
+            queue_tab, fg_color="transparent",
+            scrollbar_button_color=BORDER, scrollbar_button_hover_color=FG_DIM
+        )
+        self.jobs_frame.pack(fill="both", expand=True)
+
+        ctk.CTkButton(
+            queue_tab, text="Убрать завершённые", height=30,
+            fg_color=BG_INPUT, hover_color=BORDER, text_color=FG_TEXT,
+            border_width=1, border_color=BORDER, corner_radius=8,
+            font=ctk.CTkFont(size=12),
+            command=self._remove_finished_jobs
+        ).pack(anchor="e", pady=(8, 0))
 
         # Scrollable list of sources
         scroll = ctk.CTkScrollableFrame(
-            inner_right, fg_color="transparent",
+            help_tab, fg_color="transparent",
             scrollbar_button_color=BORDER, scrollbar_button_hover_color=FG_DIM
         )
         scroll.pack(fill="both", expand=True)
@@ -406,12 +414,9 @@ class App(ctk.CTk):
             self.folder_label.configure(text=self._truncate_path(self.folder))
 
     def _start_download(self):
-        if self.is_downloading:
-            return
-
         src = self.source_var.get()
-        book_id = self.book_id_entry.get().strip()
-        if not book_id:
+        book_ids = self.book_id_entry.get().split()
+        if not book_ids:
             self._set_status("Укажите идентификатор книги", ERROR)
             return
 
@@ -419,45 +424,32 @@ class App(ctk.CTk):
             if not self.login_entry.get().strip() or not self.password_entry.get().strip():
                 self._set_status("Укажите логин и пароль", ERROR)
                 return
-
-        self.is_downloading = True
-        self.download_btn.configure(state="disabled", fg_color=BORDER)
-        self.progress_bar.set(0)
-        self.progress_bar.pack(fill="x", pady=(0, 6))
-        self._set_status("Скачивание… Пожалуйста, подождите.", FG_DIM)
-
-        # Build config
+            self.credentials[src] = (self.login_entry.get(), self.password_entry.get())
+
+        output = OUTPUT_FORMATS[self.output_var.get()]
+        for book_id in book_ids:
+            self.job_queue.add(src, book_id, self.folder, output)
+        self.scheduler.wake_up()
+        self.book_id_entry.delete(0, "end")
+        self.tabs.set("Очередь")
+        self._set_status(f"Добавлено в очередь: {len(book_ids)}", FG_DIM)
+
+    def _job_config(self, job: BatchJob):
+        # saved credentials from config.ini, overridden by the ones typed in this session
         config = configparser.ConfigParser()
-        config.read_string(f"[{src}]")
-        config[src]["login"] = self.login_entry.get()
-        config[src]["password"] = self.password_entry.get()
-        config[src]["folder"] = self.folder
-
-        self.queue = queue.Queue()
-
-        thread = threading.Thread(
-            target=self._download_thread,
-            args=(src, config, book_id, self.queue),
-            daemon=True,
-        )
-        thread.start()
-
-    def _download_thread(self, source, config, book_id, q: queue.Queue):
-        try:
-            func = DOWNLOAD_FUNCTIONS[source]
-            error_text, result = func(config, book_id, q)
-            if error_text:
-                self.after(0, self._download_finished, f"Ошибка: {error_text}", ERROR)
-            else:
-                self.after(0, self._download_finished, f"Книга сохранена в {result}", SUCCESS)
-        except Exception as e:
-            self.after(0, self._download_finished, f"Ошибка: {e}", ERROR)
-
-    def _download_finished(self, message, color):
-        self.is_downloading = False
-        self.download_btn.configure(state="normal", fg_color=ACCENT)
-        self.progress_bar.pack_forget()
-        self._set_status(message, color)
+        config.read("config.ini", encoding="utf-8")
+        if not config.has_section(job.source):
+            config.add_section(job.source)
+        if job.source in self.credentials:
+            config[job.source]["login"], config[job.source]["password"] = self.credentials[job.source]
+        if job.folder:
+            config[job.source]["folder"] = job.folder
+        if job.output:
+            config[job.source]["output"] = job.output
+        return config
+
+    def _remove_finished_jobs(self):
+        self.job_queue.remove_finished()
 
     def _set_status(self, text, color=FG_DIM):
         self.status_label.configure(text=text, text_color=color)
@@ -466,16 +458,56 @@ class App(ctk.CTk):
     # Progress polling
     # =======================================================================
     def _poll_progress(self):
-        if self.is_downloading and self.queue:
-            try:
-                while not self.queue.empty():
-                    val = self.queue.get_nowait()
-                    if isinstance(val, (int, float)):
-                        self.progress_bar.set(min(val, 1.0))
-            except Exception:
-                pass
+        jobs = self.job_queue.get_jobs()
+        job_ids = {job.job_id for job in jobs}
+        for job_id in list(self.job_rows):
+            if job_id not in job_ids:
+                self.job_rows.pop(job_id)["frame"].destroy()
+        for job in jobs:
+            self._update_job_row(job)
         self.after(100, self._poll_progress)
 
+    def _update_job_row(self, job: BatchJob):
+        row = self.job_rows.get(job.job_id)
+        if row is None:
+            frame = ctk.CTkFrame(self.jobs_frame, fg_color=BG_INPUT, corner_radius=10,
+                                 border_width=1, border_color=BORDER)
+            frame.pack(fill="x", pady=(0, 8))
+            title = ctk.CTkLabel(frame, text=f"{job.source}: {job.book_id}",
+                                 font=ctk.CTkFont(size=13, weight="bold"), text_color=FG_TEXT,
+                                 anchor="w", wraplength=340)
+            title.pack(fill="x", padx=12, pady=(8, 2))
+            progress_bar = ctk.CTkProgressBar(frame, progress_color=ACCENT, fg_color=BG_CARD,
+                                              height=6, corner_radius=3)
+            progress_bar.pack(fill="x", padx=12, pady=(0, 4))
+            status = ctk.CTkLabel(frame, text="", font=ctk.CTkFont(size=11), text_color=FG_DIM,
+                                  anchor="w", justify="left", wraplength=340)
+            status.pack(fill="x", padx=12, pady=(0, 8))
+            row = {"frame": frame, "progress_bar": progress_bar, "status": status, "state": None}
+            self.job_rows[job.job_id] = row
+        state = (job.status, job.progress, job.message, job.event)
+        if state == row["state"]:
+            return
+        finished_now = job.is_finished() and row["state"] is not None and row["state"][0] != job.status
+        row["state"] = state
+        row["progress_bar"].set(job.progress)
+        status_text = JOB_STATUS_TEXT[job.status]
+        color = FG_DIM
+        if job.status == BatchJob.STATUS_DONE:
+            status_text = f"Книга сохранена в {job.message}"
+            color = SUCCESS
+        elif job.status == BatchJob.STATUS_FAILED:
+            status_text = f"Ошибка: {job.message}"
+            color = ERROR
+        elif job.status == BatchJob.STATUS_RUNNING:
+            if job.event is not None:
+                status_text = f"{status_text}: {format_event(ProgressEvent.from_dict(job.event))}"
+            else:
+                status_text = f"{status_text}: {round(job.progress * 100)}%"
+        row["status"].configure(text=status_text, text_color=color)
+        if finished_now:
+            self._set_status(f"{job.source} {job.book_id}: {status_text}", color)
+
 
 # ---------------------------------------------------------------------------
 # Entry point
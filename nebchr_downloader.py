@@ -1,13 +1,13 @@
-from selenium import webdriver
 import logging
 import os
 import re
 
-import requests
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
-from abstract_lib_downloader import LibraryDownloader
+from abstract_lib_downloader import AuthorizationRequired, LibraryDownloader
+from browser_pool import BROWSER_POOL, create_headless_chrome
+from progress_events import STAGE_BOOK
 
 
 class NEBCHRDownloader(LibraryDownloader):
@@ -18,28 +18,15 @@ class NEBCHRDownloader(LibraryDownloader):
         "referer": "https://catalog.libfl.ru/"
     }
     current_section = "NEBCHR"
+    # the library gives a whole PDF, there are no page images to package
+    OUTPUT_PACKAGING = False
+    driver = None
     queue = None
     page_from = 1
 
     def __init__(self, config):
         self.init_authorized_access(config)
 
-        options = webdriver.ChromeOptions()
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--headless")
-        options.add_argument("--window-position=-10000,-10000")
-        self.driver = webdriver.Chrome(options=options)
-        logging.info("Initialized driver")
-
-    def __del__(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-                logging.info("Closed driver")
-            except Exception as e:
-                logging.error(f"Exception closing driver {e}")
-
     def open_site(self):
         self.driver.get(self.URL_LOGIN)
         element_username = self.driver.find_element(by=By.ID, value="login_email")
@@ -55,6 +42,17 @@ class NEBCHRDownloader(LibraryDownloader):
 
         element_button_ok.click()
 
+    def log_in(self):
+        """
+        @return: cookies of the new session
+        """
+        with BROWSER_POOL.lease((self.current_section, self.login), create_headless_chrome) as browser:
+            self.driver = browser.driver
+            self.make_pause()
+            self.open_site()
+            browser.logged_in = True
+            self.make_pause()
+            return self.driver.get_cookies()
 
     def download_book(self, book_id, queue, page_from=1):
         error_text = None
@@ -62,35 +60,38 @@ class NEBCHRDownloader(LibraryDownloader):
             self.queue = queue
             self.create_folders(book_id)
             self.page_from = page_from
-            self.make_pause()
-            self.open_site()
-            self.make_pause()
-            self.download_pages(book_id)
+            if self.manifest.is_done(self.manifest.BOOK_KEY):
+                logging.info(f"Book {book_id} already downloaded")
+                return error_text, os.path.abspath(self.folder)
+            self.run_authorized(lambda cookies: self.download_pages(book_id, cookies), self.log_in)
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
-    def download_pages(self, book_id):
-        cookies = self.driver.get_cookies()
-        cookies_str = ";".join([c["name"] + "=" + c["value"] for c in cookies])
+    def download_pages(self, book_id, cookies):
+        cookies_str = self.cookies_to_header(cookies)
 
         book_url = self.URL_BOOK % book_id
         main_page = self.download_html(book_url, additional_headers={"Cookie": cookies_str, })
-        self.make_pause()
         match = re.search('const fileName = (.+?);',
                               main_page.text, re.S)
         if not match:
-            raise Exception(f"Could not start downloading")
+            # the reader page has no file link without a valid session
+            raise AuthorizationRequired(f"Could not start downloading")
 
         book_link = match.group(1).strip().strip('"')
         image_link = self.URL_CDN + book_link
-        response = requests.get(image_link)
+        response = self.http_get(image_link, stream=True)
         full_filename = os.path.join(self.folder, book_id + ".pdf")
         if not response.ok:
             raise Exception(f"Exception when downloading")
-        self.queue.put_nowait(0.5)
-        with open(full_filename, 'wb') as fout:
-            fout.write(response.content)
-            logging.info(f"Downloaded book")
-        self.queue.put_nowait(1)
\ No newline at end of file
+        if response.headers.get("Content-Length", "").isdigit():
+            self.get_progress_reporter().set_bytes_total(int(response.headers["Content-Length"]))
+        self.report_progress(0, 1, STAGE_BOOK)
+        checksum = self.save_response(response, full_filename)
+        logging.info(f"Downloaded book")
+        self.manifest.add(self.manifest.BOOK_KEY, full_filename, checksum)
+        self.report_progress(1, 1, STAGE_BOOK)
\ No newline at end of file
@@ -1,19 +1,56 @@
 import logging
 import os
+import re
 
-import requests
-from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
 from tqdm import tqdm
 
-from abstract_lib_downloader import LibraryDownloader
+from abstract_lib_downloader import AuthorizationRequired, LibraryDownloader
+from browser_pool import BROWSER_POOL, create_headless_chrome
+
+
+class PageLinkTemplate:
+    """
+    Image link of any page, built from the links of two neighbouring pages:
+    the only number that differs between them is the page number
+    """
+
+    def __init__(self, prefix, suffix, offset, width):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.offset = offset
+        self.width = width
+
+    def get_url(self, page_num):
+        return self.prefix + str(page_num + self.offset).zfill(self.width) + self.suffix
+
+    @classmethod
+    def from_neighbour_links(cls, link, page_num, next_link):
+        """
+        @return: the template or None if the links do not differ in exactly one number growing by one
+        """
+        parts = re.split(r"(\d+)", link)
+        next_parts = re.split(r"(\d+)", next_link)
+        if len(parts) != len(next_parts):
+            return None
+        different = [i for i in range(len(parts)) if parts[i] != next_parts[i]]
+        if len(different) != 1 or different[0] % 2 == 0:
+            return None
+        i = different[0]
+        if int(next_parts[i]) - int(parts[i]) != 1:
+            return None
+        width = len(parts[i]) if parts[i].startswith("0") else 0
+        return cls("".join(parts[:i]), "".join(parts[i + 1:]), int(parts[i]) - page_num, width)
 
 
 class NLRSDownloader(LibraryDownloader):
+    URL_SITE = "https://e.nlrs.ru/"
     URL_LOGIN = "https://e.nlrs.ru/login"
     URL_BOOK = "https://e.nlrs.ru/online/"
+    PAGE_LOAD_TIMEOUT_SEC = 10
     current_section = "NLRS"
     driver = None
     queue = None
@@ -22,36 +59,34 @@ class NLRSDownloader(LibraryDownloader):
     def __init__(self, config):
         self.init_authorized_access(config)
 
-        options = webdriver.ChromeOptions()
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--headless")
-        options.add_argument("--window-position=-10000,-10000")
-        self.driver = webdriver.Chrome(options=options)
-        logging.info("Initialized driver")
-
-    def __del__(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-                logging.info("Closed driver")
-            except Exception as e:
-                logging.error(f"Exception closing driver {e}")
-
     def download_book(self, book_id, queue, page_from=1):
         error_text = None
         try:
             self.queue = queue
             self.create_folders(book_id)
             self.page_from = page_from
-            self.make_pause()
-            self.open_site()
-            self.download_pages(book_id)
+            self.run_authorized(lambda cookies: self.download_pages(book_id, cookies), self.log_in)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
+    def log_in(self):
+        """
+        @return: cookies of the new session
+        """
+        with BROWSER_POOL.lease((self.current_section, self.login), create_headless_chrome) as browser:
+            self.driver = browser.driver
+            self.make_pause()
+            self.open_site()
+            browser.logged_in = True
+            self.make_pause()
+            return self.driver.get_cookies()
+
     def open_site(self):
         self.driver.get(self.URL_LOGIN)
         element_username = self.driver.find_element(by=By.NAME, value="username")
@@ -63,53 +98,166 @@ class NLRSDownloader(LibraryDownloader):
         element_button_ok = self.driver.find_element(by=By.CLASS_NAME, value="btn-primary")
         element_button_ok.click()
 
-    def download_pages(self, book_id):
-        self.driver.get(self.URL_BOOK + book_id)
-        self.move_to_beginning()
-        self.download_images()
+    def download_pages(self, book_id, cookies):
+        with BROWSER_POOL.lease((self.current_section, self.login), create_headless_chrome) as browser:
+            self.driver = browser.driver
+            if not browser.logged_in:
+                # cookies can only be set for the site that is open
+                self.driver.get(self.URL_SITE)
+                for cookie in cookies:
+                    self.driver.add_cookie(cookie)
+                browser.logged_in = True
+            self.driver.get(self.URL_BOOK + book_id)
+            if self.driver.current_url.startswith(self.URL_LOGIN):
+                raise AuthorizationRequired(f"Not logged in to {self.current_section}")
+            viewer_page = self.move_to_beginning()
+            page_link_template = self.resolve_page_link_template(viewer_page)
+            if page_link_template is None:
+                logging.info("Could not find out the page links, downloading page by page in the browser")
+                self.download_images(viewer_page)
+            else:
+                self.download_images_directly(page_link_template)
+
+    def resolve_page_link_template(self, viewer_page):
+        """
+        Compare the image links of the page the viewer shows and the next one, then go back
+        """
+        if viewer_page >= self.last_page:
+            return None
+        image_link = self.get_image_link()
+        self.get_next_page_button().click()
+        try:
+            WebDriverWait(self.driver, self.PAGE_LOAD_TIMEOUT_SEC).until(
+                lambda driver: self.get_image_link() != image_link)
+        except TimeoutException:
+            # the image may be late while the viewer has moved on already
+            if self.get_viewer_page() != viewer_page:
+                self.get_previous_page_button().click()
+            return None
+        next_image_link = self.get_image_link()
+        self.get_previous_page_button().click()
+        page_link_template = PageLinkTemplate.from_neighbour_links(image_link, viewer_page, next_image_link)
+        if page_link_template is not None:
+            logging.info(f"Page links: {page_link_template.get_url(self.page_from)}, "
+                         f"{page_link_template.get_url(self.page_from + 1)}...")
+        return page_link_template
+
+    def get_image_link(self):
+        wait = WebDriverWait(self.driver, 0)
+        element_file_viewer = wait.until(
+            expected_conditions.element_to_be_clickable((By.ID, "root")))
+        element_image = element_file_viewer. \
+            find_element(by=By.ID, value="page-container"). \
+            find_element(by=By.TAG_NAME, value="img")
+        return element_image.get_attribute("src")
+
+    def get_cookies_str(self):
+        cookies = self.driver.get_cookies()
+        return ";".join([c["name"] + "=" + c["value"] for c in cookies])
+
+    def download_images_directly(self, page_link_template):
+        """
+        Fetch the page images over HTTP with the cookies of the logged in browser, several at a time
+        """
+        cookies_str = self.get_cookies_str()
+        self.download_page_list(list(range(self.page_from, self.last_page + 1)),
+                                lambda i, _: self.download_image(page_link_template.get_url(i), i, cookies_str))
+
+    def get_page_filename(self, page_num):
+        return os.path.join(self.folder, str(page_num).zfill(4) + ".png")
+
+    def download_image(self, image_link, page_num, cookies_str):
+        """
+        @return: filename of the page
+        """
+        full_filename = self.get_page_filename(page_num)
+        if self.manifest.is_done(page_num):
+            logging.info(f"Page {page_num} already downloaded")
+            return self.manifest.get_file(page_num)
+        logging.info(f"Downloading page {page_num} out of {self.last_page}")
+        headers = {
+            "cookie": cookies_str,
+        }
+        response = self.get_page_content(image_link, headers, stream=True)
+        checksum = self.save_response(response, full_filename)
+        self.manifest.add(page_num, full_filename, checksum)
+        logging.info(f"Downloaded page {page_num} out of {self.last_page}")
+        return full_filename
 
     def move_to_beginning(self):
+        """
+        @return: the page the viewer shows now: page_from if the slider moved, otherwise the viewer is
+        clicked back to page_from (if it opened after it) and download_images clicks on from the page it shows
+        """
         self.make_pause()
         wait = WebDriverWait(self.driver, self.PAUSE_SEC)
         slider = wait.until(
             expected_conditions.element_to_be_clickable((By.CSS_SELECTOR, "input[type='range']")))
         current_page = int(slider.get_attribute("value"))
         self.last_page = int(slider.get_attribute("max")) + 1
+        if self.seek_to_page(slider, self.page_from):
+            logging.info(f"Moved to page {self.page_from}")
+            return self.page_from
         if current_page > self.page_from:
             for i in range(current_page, self.page_from - 1, -1):
                 self.make_pause()
                 button_previous_page = self.get_previous_page_button()
                 button_previous_page.click()
                 logging.info(f"Moving to page {i}")
-        logging.info(f"Moved to page {self.page_from}")
+        viewer_page = self.get_viewer_page()
+        logging.info(f"Moved to page {viewer_page}")
+        return viewer_page
 
-    def download_images(self):
-        cookies = self.driver.get_cookies()
-        cookies_str = ";".join([c["name"] + "=" + c["value"] for c in cookies])
-        n = self.last_page + 1
-        for i in tqdm(range(1, self.last_page + 1)):
-            self.queue.put_nowait(round(i / n, 2))
+    def get_viewer_page(self):
+        """
+        @return: the page the viewer shows, by the page slider (its values start with 0)
+        """
+        wait = WebDriverWait(self.driver, self.PAUSE_SEC)
+        slider = wait.until(
+            expected_conditions.element_to_be_clickable((By.CSS_SELECTOR, "input[type='range']")))
+        return int(slider.get_attribute("value")) + 1
+
+    def seek_to_page(self, slider, page_num):
+        """
+        Jump to the page by setting the page slider (its values start with 0) the way a user drag does.
+        The value is set through the native setter, otherwise React ignores the change
+        @return: True if the viewer moved to the page
+        """
+        slider_value = str(page_num - 1)
+        if slider.get_attribute("value") == slider_value:
+            return True
+        self.driver.execute_script("""
+            const slider = arguments[0];
+            const setValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+            setValue.call(slider, arguments[1]);
+            slider.dispatchEvent(new Event('input', {bubbles: true}));
+            slider.dispatchEvent(new Event('change', {bubbles: true}));
+            """, slider, slider_value)
+        try:
+            WebDriverWait(self.driver, self.PAGE_LOAD_TIMEOUT_SEC).until(
+                lambda driver: slider.get_attribute("value") == slider_value)
+        except TimeoutException:
+            logging.info(f"Could not move the slider to page {page_num}, moving page by page")
+            return False
+        # let the viewer load the image of the new page
+        self.make_pause()
+        return True
+
+    def download_images(self, viewer_page=1):
+        """
+        Save the pages one by one in the viewer, starting from the page it shows (viewer_page)
+        """
+        cookies_str = self.get_cookies_str()
+        for i in tqdm(range(viewer_page, self.last_page + 1)):
+            self.report_progress(i - 1, self.last_page)
             if i >= self.page_from:
-                logging.info(f"Downloading page {i} out of {self.last_page}")
-                filename = str(i).zfill(4) + ".png"
-                full_filename = os.path.join(self.folder, filename)
-                self.make_pause()
-                wait = WebDriverWait(self.driver, 0)
-                element_file_viewer = wait.until(
-                    expected_conditions.element_to_be_clickable((By.ID, "root")))
-                element_image = element_file_viewer. \
-                    find_element(by=By.ID, value="page-container"). \
-                    find_element(by=By.TAG_NAME, value="img")
-                image_link = element_image.get_attribute("src")
-                headers = {
-                    "cookie": cookies_str,
-                }
-                response = requests.get(image_link, headers=headers)
-                with open(full_filename, 'wb') as fout:
-                    fout.write(response.content)
-                logging.info(f"Downloaded page {i} out of {self.last_page}")
+                if not self.manifest.is_done(i):
+                    self.make_pause()
+                    self.download_image(self.get_image_link(), i, cookies_str)
+                self.package_page(self.manifest.get_file(i))
             if i < self.last_page:
                 self.get_next_page_button().click()
+        self.report_progress(self.last_page, self.last_page)
 
     def get_next_page_button(self):
         wait = WebDriverWait(self.driver, self.PAUSE_SEC)
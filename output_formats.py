@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+"""
+Names of the output formats and recompression methods, kept apart from output_packager.py and
+page_recompressor.py so that the interfaces can list them without importing PIL
+"""
+__author__ = "gisly"
+
+OUTPUT_FOLDER = "folder"
+OUTPUT_PDF = "pdf"
+OUTPUT_CBZ = "cbz"
+OUTPUT_ZIP = "zip"
+OUTPUT_FORMATS = [OUTPUT_FOLDER, OUTPUT_PDF, OUTPUT_CBZ, OUTPUT_ZIP]
+
+RECOMPRESS_NONE = "none"
+RECOMPRESS_PNG = "png"
+RECOMPRESS_WEBP = "webp"
+RECOMPRESS_JXL = "jxl"
+RECOMPRESS_JPEG = "jpeg"
+
+# method -> Pillow format, file extension
+RECOMPRESS_FORMATS = {
+    RECOMPRESS_PNG: ("PNG", ".png"),
+    RECOMPRESS_WEBP: ("WEBP", ".webp"),
+    RECOMPRESS_JXL: ("JXL", ".jxl"),
+    RECOMPRESS_JPEG: ("JPEG", ".jpg"),
+}
+RECOMPRESS_METHODS = [RECOMPRESS_NONE] + list(RECOMPRESS_FORMATS)
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import logging
+import os
+import struct
+import zipfile
+import zlib
+
+from PIL import Image
+
+from output_formats import OUTPUT_CBZ, OUTPUT_FOLDER, OUTPUT_PDF, OUTPUT_ZIP
+
+
+class OutputPackager:
+    """
+    Collects the finished pages of a book, in page order, into a single file next to the book folder
+    while the book is downloading. The base class keeps the pages in the folder only
+    """
+    EXTENSION = None
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.output_filename = os.path.normpath(folder) + self.EXTENSION if self.EXTENSION else None
+        self.temporary_filename = self.output_filename + ".part" if self.output_filename else None
+        self.page_num = 0
+
+    def add_page(self, filename):
+        self.page_num += 1
+
+    def finish(self):
+        """
+        @return: filename of the package or None if there is nothing to package
+        """
+        return None
+
+    def abort(self):
+        pass
+
+
+class ZipPackager(OutputPackager):
+    """
+    Stores the page images as they are (they are compressed already) in a ZIP archive
+    """
+    EXTENSION = ".zip"
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.archive = None
+
+    def add_page(self, filename):
+        if self.archive is None:
+            # the archive is created with the first page, so that a book without pages leaves no file
+            self.archive = zipfile.ZipFile(self.temporary_filename, "w", zipfile.ZIP_STORED)
+        super().add_page(filename)
+        extension = os.path.splitext(filename)[1].lower()
+        self.archive.write(filename, str(self.page_num).zfill(5) + extension)
+
+    def finish(self):
+        if self.archive is None:
+            return None
+        self.archive.close()
+        self.archive = None
+        os.replace(self.temporary_filename, self.output_filename)
+        return self.output_filename
+
+    def abort(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+            os.remove(self.temporary_filename)
+
+
+class CbzPackager(ZipPackager):
+    """
+    Comic book archive: a ZIP archive with the page images in reading order
+    """
+    EXTENSION = ".cbz"
+
+
+class PdfPackager(OutputPackager):
+    """
+    Writes a PDF page by page with one image per page. JPEG files are embedded as they are,
+    the image data of PNG files is reused when PDF can read it, other images are compressed again
+    """
+    EXTENSION = ".pdf"
+    DEFAULT_DPI = 96
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    # PNG colour type -> number of colour components, for 8-bit non-interlaced images only
+    PNG_COLORS = {0: 1, 2: 3}
+    COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.fout = None
+        self.offsets = dict()
+        self.page_ids = []
+        self.next_id = self.PAGES_ID + 1
+
+    def add_page(self, filename):
+        if self.fout is None:
+            self.fout = open(self.temporary_filename, "wb")
+            self.fout.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        super().add_page(filename)
+        with Image.open(filename) as image:
+            width, height = image.size
+            dpi = image.info.get("dpi", (self.DEFAULT_DPI, self.DEFAULT_DPI))
+            image_format = image.format
+            mode = image.mode
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+
+        if image_format == "JPEG" and mode in ("L", "RGB", "CMYK"):
+            self.write_jpeg(image_id, filename, width, height, mode)
+        elif image_format != "PNG" or not self.write_png(image_id, filename):
+            self.write_decoded_image(image_id, filename)
+
+        page_width = self.to_points(width, dpi[0])
+        page_height = self.to_points(height, dpi[1])
+        self.write_stream(content_id, b"",
+                          f"q {page_width} 0 0 {page_height} 0 0 cm /Im0 Do Q".encode("ascii"))
+        self.write_object(page_id, f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+                                   f"/MediaBox [0 0 {page_width} {page_height}] "
+                                   f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                                   f"/Contents {content_id} 0 R >>".encode("ascii"))
+        self.page_ids.append(page_id)
+
+    def finish(self):
+        if self.fout is None:
+            return None
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.write_object(self.PAGES_ID,
+                          f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode("ascii"))
+        self.write_object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode("ascii"))
+        xref_offset = self.fout.tell()
+        self.fout.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode("ascii"))
+        for object_id in range(1, self.next_id):
+            self.fout.write(f"{self.offsets[object_id]:010d} 00000 n \n".encode("ascii"))
+        self.fout.write(f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\n"
+                        f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self.fout.close()
+        self.fout = None
+        os.replace(self.temporary_filename, self.output_filename)
+        return self.output_filename
+
+    def abort(self):
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+            os.remove(self.temporary_filename)
+
+    def write_jpeg(self, image_id, filename, width, height, mode):
+        components = len(mode)
+        # Adobe software writes CMYK JPEGs with inverted values
+        decode = " /Decode [1 0 1 0 1 0 1 0]" if mode == "CMYK" else ""
+        with open(filename, "rb") as fin:
+            data = fin.read()
+        self.write_stream(image_id, self.image_dictionary(width, height, components) +
+                          f" /Filter /DCTDecode{decode}".encode("ascii"), data)
+
+    def write_png(self, image_id, filename):
+        """
+        Reuse the compressed data of an 8-bit grey or RGB PNG: PDF decodes it with the PNG predictors
+        @return: False if the PNG has to be decoded
+        """
+        with open(filename, "rb") as fin:
+            data = fin.read()
+        if not data.startswith(self.PNG_SIGNATURE):
+            return False
+        position = len(self.PNG_SIGNATURE)
+        header = None
+        image_data = []
+        while position + 8 <= len(data):
+            length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+            chunk = data[position + 8:position + 8 + length]
+            position += length + 12
+            if chunk_type == b"IHDR":
+                header = struct.unpack(">IIBBBBB", chunk)
+            elif chunk_type == b"IDAT":
+                image_data.append(chunk)
+            elif chunk_type == b"tRNS":
+                # transparency would need a soft mask
+                return False
+            elif chunk_type == b"IEND":
+                break
+        if header is None or not image_data:
+            return False
+        width, height, bit_depth, color_type, _, _, interlace = header
+        if bit_depth != 8 or interlace or color_type not in self.PNG_COLORS:
+            return False
+        colors = self.PNG_COLORS[color_type]
+        self.write_stream(image_id, self.image_dictionary(width, height, colors) +
+                          f" /Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {colors} "
+                          f"/BitsPerComponent 8 /Columns {width} >>".encode("ascii"), b"".join(image_data))
+        return True
+
+    def write_decoded_image(self, image_id, filename):
+        with Image.open(filename) as image:
+            image = image.convert("L" if image.mode in ("1", "L", "LA", "I", "I;16") else "RGB")
+            width, height = image.size
+            data = zlib.compress(image.tobytes())
+        self.write_stream(image_id, self.image_dictionary(width, height, len(image.mode)) +
+                          b" /Filter /FlateDecode", data)
+
+    def image_dictionary(self, width, height, components):
+        return (f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace {self.COLOR_SPACES[components]} /BitsPerComponent 8").encode("ascii")
+
+    def write_stream(self, object_id, dictionary, data):
+        self.write_object(object_id, b"<< " + dictionary + f" /Length {len(data)} >>\nstream\n".encode("ascii") +
+                          data + b"\nendstream")
+
+    def write_object(self, object_id, body):
+        self.offsets[object_id] = self.fout.tell()
+        self.fout.write(f"{object_id} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+
+    @staticmethod
+    def to_points(pixels, dpi):
+        if not dpi or dpi <= 0:
+            dpi = PdfPackager.DEFAULT_DPI
+        return round(pixels * 72 / dpi, 2)
+
+
+PACKAGERS = {
+    OUTPUT_FOLDER: OutputPackager,
+    OUTPUT_PDF: PdfPackager,
+    OUTPUT_CBZ: CbzPackager,
+    OUTPUT_ZIP: ZipPackager,
+}
+
+
+def create_packager(output_format, folder):
+    if output_format not in PACKAGERS:
+        raise Exception(f"Unknown output format {output_format}, expected one of {', '.join(PACKAGERS)}")
+    logging.info(f"Output format: {output_format}")
+    return PACKAGERS[output_format](folder)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import hashlib
+import logging
+import os
+import threading
+
+
+class PageCache:
+    """
+    Local copy of downloaded pages shared by all books and runs. A page is found by its key
+    (a canonical URL or page id), the key points to the SHA-256 of the content, and the content
+    is stored once under that hash. When the cache grows over max_size, the least recently used
+    contents are removed together with the keys pointing to them (every hit touches the modification
+    time of its content)
+    """
+    CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".elib_downloader", "cache")
+    MAX_SIZE = 1024 * 1024 * 1024
+    # eviction goes a bit below the limit, so that it does not run on every new page
+    EVICTION_TARGET = 0.9
+    KEYS_FOLDER = "keys"
+    OBJECTS_FOLDER = "objects"
+
+    def __init__(self, folder=CACHE_FOLDER, max_size=MAX_SIZE):
+        """
+        @param max_size: size limit in bytes, 0 disables the cache
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.current_size = None
+
+    def is_enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        """
+        @return: cached content or None
+        """
+        if not self.is_enabled():
+            return None
+        key_filename = self.get_key_filename(key)
+        try:
+            with open(key_filename, encoding="ascii") as fin:
+                object_filename = self.get_object_filename(fin.read().strip())
+            with open(object_filename, "rb") as fin:
+                content = fin.read()
+            os.utime(object_filename)
+        except OSError:
+            # not cached or evicted in the meantime
+            return None
+        return content
+
+    def put(self, key, content):
+        if not self.is_enabled():
+            return
+        checksum = hashlib.sha256(content).hexdigest()
+        object_filename = self.get_object_filename(checksum)
+        try:
+            with self.lock:
+                self.ensure_size_known()
+                if not os.path.exists(object_filename):
+                    self.write_file(object_filename, content)
+                    self.current_size += len(content)
+                self.write_file(self.get_key_filename(key), checksum.encode("ascii"))
+                if self.current_size > self.max_size:
+                    self.evict()
+        except OSError as e:
+            logging.error(f"Could not cache {key}: {e}")
+
+    def ensure_size_known(self):
+        if self.current_size is None:
+            self.current_size = sum(size for _, _, size in self.list_objects())
+
+    def evict(self):
+        target_size = self.max_size * self.EVICTION_TARGET
+        for _, object_filename, size in sorted(self.list_objects()):
+            if self.current_size <= target_size:
+                break
+            try:
+                os.remove(object_filename)
+                self.current_size -= size
+            except OSError:
+                pass
+        self.remove_orphan_keys()
+        logging.info(f"Page cache reduced to {self.current_size / (1024 * 1024):.1f} MB")
+
+    def remove_orphan_keys(self):
+        """
+        Remove the keys whose content is no longer cached
+        """
+        keys_folder = os.path.join(self.folder, self.KEYS_FOLDER)
+        if not os.path.isdir(keys_folder):
+            return
+        for prefix in os.listdir(keys_folder):
+            prefix_folder = os.path.join(keys_folder, prefix)
+            for name in os.listdir(prefix_folder):
+                if name.endswith(".part"):
+                    continue
+                key_filename = os.path.join(prefix_folder, name)
+                try:
+                    with open(key_filename, encoding="ascii") as fin:
+                        object_filename = self.get_object_filename(fin.read().strip())
+                    if not os.path.exists(object_filename):
+                        os.remove(key_filename)
+                except OSError:
+                    pass
+
+    def list_objects(self):
+        """
+        @return: (modification time, filename, size) of every cached content
+        """
+        objects = []
+        objects_folder = os.path.join(self.folder, self.OBJECTS_FOLDER)
+        if not os.path.isdir(objects_folder):
+            return objects
+        for prefix in os.listdir(objects_folder):
+            prefix_folder = os.path.join(objects_folder, prefix)
+            for name in os.listdir(prefix_folder):
+                if name.endswith(".part"):
+                    continue
+                filename = os.path.join(prefix_folder, name)
+                stat = os.stat(filename)
+                objects.append((stat.st_mtime, filename, stat.st_size))
+        return objects
+
+    def get_key_filename(self, key):
+        key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, self.KEYS_FOLDER, key_hash[:2], key_hash)
+
+    def get_object_filename(self, checksum):
+        return os.path.join(self.folder, self.OBJECTS_FOLDER, checksum[:2], checksum)
+
+    @staticmethod
+    def write_file(filename, content):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary_filename = f"{filename}.{threading.get_ident()}.part"
+        with open(temporary_filename, "wb") as fout:
+            fout.write(content)
+        os.replace(temporary_filename, filename)
+
+
+PAGE_CACHE = PageCache()
+NO_PAGE_CACHE = PageCache(max_size=0)
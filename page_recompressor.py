@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from book_manifest import BookManifest
+from instrumentation import timed_call
+from output_formats import RECOMPRESS_FORMATS, RECOMPRESS_JPEG, RECOMPRESS_METHODS, RECOMPRESS_PNG
+
+
+def recompress_page(filename, method, jpeg_quality):
+    """
+    Save the page again in a smaller format. Lossless results are kept only if they are smaller;
+    JPEG pages are left as they are, since encoding them again only loses quality
+    @return: filename of the page after recompression and its SHA-256
+    """
+    image_format, extension = RECOMPRESS_FORMATS[method]
+    new_filename = os.path.splitext(filename)[0] + extension
+    temporary_filename = new_filename + ".part"
+    with Image.open(filename) as image:
+        if image.format == "JPEG":
+            return filename, BookManifest.file_checksum(filename)
+        if method == RECOMPRESS_PNG:
+            image.save(temporary_filename, image_format, optimize=True)
+        elif method == RECOMPRESS_JPEG:
+            image = image.convert("L" if image.mode in ("1", "L", "LA") else "RGB")
+            image.save(temporary_filename, image_format, quality=jpeg_quality, optimize=True)
+        else:
+            image.save(temporary_filename, image_format, lossless=True)
+    if method != RECOMPRESS_JPEG and os.path.getsize(temporary_filename) >= os.path.getsize(filename):
+        os.remove(temporary_filename)
+        return filename, BookManifest.file_checksum(filename)
+    os.replace(temporary_filename, new_filename)
+    if new_filename != filename:
+        os.remove(filename)
+    return new_filename, BookManifest.file_checksum(new_filename)
+
+
+class PageRecompressor:
+    """
+    Recompresses the finished pages of a book in separate processes while the next pages are downloaded,
+    then passes them on in page order (to the packager)
+    """
+    WORKERS = 2
+    MAX_PENDING_PAGES = 8
+    JPEG_QUALITY = 90
+
+    def __init__(self, method, manifest, on_page_done, jpeg_quality=JPEG_QUALITY, instrumentation=None):
+        """
+        @param on_page_done: function(filename) called for every page in page order
+        @param instrumentation: BookInstrumentation that gets the time spent in recompression
+        """
+        if method not in RECOMPRESS_FORMATS:
+            raise Exception(f"Unknown recompression {method}, expected one of {', '.join(RECOMPRESS_METHODS)}")
+        image_format = RECOMPRESS_FORMATS[method][0]
+        Image.init()
+        if image_format not in Image.SAVE:
+            raise Exception(f"Pillow cannot write {image_format} images here")
+        self.method = method
+        self.manifest = manifest
+        self.on_page_done = on_page_done
+        self.jpeg_quality = jpeg_quality
+        self.instrumentation = instrumentation
+        self.executor = None
+        self.pending_pages = []
+
+    def add_page(self, filename):
+        recompressed_filename = self.manifest.get_recompressed_file(filename)
+        if recompressed_filename is not None:
+            # recompressed in an earlier run
+            self.pending_pages.append((filename, recompressed_filename))
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.WORKERS)
+            self.pending_pages.append((filename, self.executor.submit(timed_call, recompress_page, filename,
+                                                                      self.method, self.jpeg_quality)))
+        self.collect_pages(self.MAX_PENDING_PAGES)
+
+    def collect_pages(self, max_pending):
+        """
+        Pass on the finished pages, waiting only while more than max_pending pages are queued
+        """
+        while self.pending_pages and (isinstance(self.pending_pages[0][1], str) or
+                                      self.pending_pages[0][1].done() or
+                                      len(self.pending_pages) > max_pending):
+            filename, result = self.pending_pages.pop(0)
+            if isinstance(result, str):
+                new_filename = result
+            else:
+                (new_filename, checksum), recompress_time = result.result()
+                if self.instrumentation is not None:
+                    self.instrumentation.add_stage("recompress", recompress_time)
+                self.manifest.replace_file(filename, new_filename, checksum)
+                logging.info(f"Recompressed {new_filename}")
+            self.on_page_done(new_filename)
+
+    def finish(self):
+        """
+        @return: bytes saved by recompression over the whole book
+        """
+        try:
+            self.collect_pages(0)
+        finally:
+            self.abort()
+        return self.manifest.get_savings()
+
+    def abort(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        self.pending_pages = []
@@ -6,16 +6,19 @@ import logging
 import os
 import shutil
 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
 
 from abstract_lib_downloader import LibraryDownloader
+from browser_pool import BROWSER_POOL, create_headless_chrome
+from progress_events import STAGE_BOOK
 
 
 class PDFReaderDownloader(LibraryDownloader):
     current_section = "PDFReader"
+    # the library gives a whole PDF, there are no page images to package
+    OUTPUT_PACKAGING = False
     queue = None
     page_from = 1
     PAUSE_SEC = 20
@@ -23,38 +26,25 @@ class PDFReaderDownloader(LibraryDownloader):
     driver = None
 
     def __init__(self, config, book_id_value):
-        book_server_url = book_id_value.split("://")[-1].split("/")[0]
+        self.book_server_url = book_id_value.split("://")[-1].split("/")[0]
         self.init_non_authorized_access(config)
         self.create_common_section_folder()
-        options = webdriver.ChromeOptions()
-        options.add_experimental_option("prefs", {
+
+    def create_driver(self):
+        prefs = {
             "profile.default_content_settings.popups": 0,
             "download.default_directory": os.path.abspath(self.section_folder),
             "download.prompt_for_download": False,
             "download.directory_upgrade": True,
             "safebrowsing.enabled": False,
             "download.extensions_to_open": "application/pdf"
-        })
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--headless")
-        options.add_argument("--window-position=-10000,-10000")
-        options.add_argument("--safebrowsing-disable-download-protection")
-        options.add_argument("--safebrowsing-disable-extension-blacklist")
-        options.add_argument("--allow-running-insecure-content")
-        options.add_argument("--ignore-certificate-errors")
-        options.add_argument("--unsafely-treat-insecure-origin-as-secure=" + "http://" + book_server_url)
-
-        self.driver = webdriver.Chrome(options=options)
-        logging.info("Initialized driver")
-
-    def __del__(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-                logging.info("Closed driver")
-            except Exception as e:
-                logging.error(f"Exception closing driver {e}")
+        }
+        arguments = ["--safebrowsing-disable-download-protection",
+                     "--safebrowsing-disable-extension-blacklist",
+                     "--allow-running-insecure-content",
+                     "--ignore-certificate-errors",
+                     "--unsafely-treat-insecure-origin-as-secure=" + "http://" + self.book_server_url]
+        return create_headless_chrome(arguments, prefs)
 
     def download_book(self, book_url, queue, page_from=1):
         error_text = None
@@ -63,10 +53,19 @@ class PDFReaderDownloader(LibraryDownloader):
             book_name = book_url.strip("/").split("/")[-2]
             self.create_folders(book_name)
             self.page_from = page_from
-            self.make_pause()
-            self.open_site(book_url)
-            resulting_path = self.download_pages()
-            self.move_book(resulting_path)
+            if self.manifest.is_done(self.manifest.BOOK_KEY):
+                logging.info(f"Book {book_name} already downloaded")
+                return error_text, os.path.abspath(self.folder)
+            # the download folder and the trusted origin are browser options, so only such browsers are shared
+            browser_key = (self.current_section, os.path.abspath(self.section_folder), self.book_server_url)
+            with BROWSER_POOL.lease(browser_key, self.create_driver) as browser:
+                self.driver = browser.driver
+                # a pooled browser still lists the downloads of the books before
+                known_downloads = {download[0] for download in self.get_current_downloads()}
+                self.make_pause()
+                self.open_site(book_url)
+                resulting_path = self.download_pages(known_downloads)
+                self.move_book(resulting_path)
         except Exception as e:
             logging.error(f"Exception occurred {e}")
             error_text = str(e)
@@ -81,9 +80,10 @@ class PDFReaderDownloader(LibraryDownloader):
         self.make_pause()
         logging.info("Site loaded")
 
-    def download_pages(self):
+    def download_pages(self, known_downloads):
         """
         Download the pdf using the built-in pdfreader.js function. We have to monitor the downloads section of the browser
+        @param known_downloads: ids of the downloads started before this book
         @return:
         """
         resulting_path = None
@@ -92,14 +92,15 @@ class PDFReaderDownloader(LibraryDownloader):
         i = 0
         while i < self.ATTEMPTS_MAX:
             self.make_pause()
-            current_downloads = self.get_current_downloads()
+            current_downloads = [download for download in self.get_current_downloads()
+                                 if download[0] not in known_downloads]
             if not current_downloads:
                 break
-            current_download_properties = current_downloads[0].split("$$$")
-            current_state = int(current_download_properties[0])
-            current_percentage = int(current_download_properties[1])
-            self.queue.put_nowait(current_percentage * 0.01)
-            current_path = current_download_properties[2]
+            current_download_properties = current_downloads[0]
+            current_state = int(current_download_properties[1])
+            current_percentage = int(current_download_properties[2])
+            self.report_progress(min(max(current_percentage, 0), 100), 100, STAGE_BOOK)
+            current_path = current_download_properties[3]
             if current_state != 0 or current_percentage >= 100 or current_percentage < 0:
                 resulting_path = current_path
                 break
@@ -109,15 +110,21 @@ class PDFReaderDownloader(LibraryDownloader):
         return resulting_path
 
     def get_current_downloads(self):
+        """
+        @return: id, state, percent and file path of every download in the browser, newest first
+        """
         if not self.driver.current_url.startswith("chrome://downloads"):
             self.driver.get("chrome://downloads/")
-        return self.driver.execute_script("""
+        downloads = self.driver.execute_script("""
             return document.querySelector('downloads-manager')
             .shadowRoot.querySelector('#downloadsList')
             .items
-            .map(e => e.state + '$$$' + e.percent + '$$$' + e.filePath);
+            .map(e => e.id + '$$$' + e.state + '$$$' + e.percent + '$$$' + e.filePath);
             """)
+        return [download.split("$$$") for download in downloads]
 
     def move_book(self, old_path):
         book_name = os.path.basename(old_path)
-        shutil.move(old_path, os.path.join(self.folder, book_name))
+        new_path = os.path.join(self.folder, book_name)
+        shutil.move(old_path, new_path)
+        self.manifest.add(self.manifest.BOOK_KEY, new_path)
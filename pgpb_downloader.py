@@ -2,24 +2,30 @@
 # -*- coding: utf-8 -*
 __author__ = "gisly"
 
+import asyncio
 import logging
 import shutil
 
-import requests
 import os
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 from PyPDF2 import PdfReader, PdfWriter
 
-from abstract_lib_downloader import LibraryDownloader
+from async_lib_downloader import AsyncLibraryDownloader
+from instrumentation import timed_call
 
 
-class PGPBDownloader(LibraryDownloader):
+class PGPBDownloader(AsyncLibraryDownloader):
     PGPB_URL = 'https://pgpb.ru'
     PGPB_MAIN_SUFFIX = '/digitization/document'
     current_section = "PGPB"
+    # the library gives a whole PDF, there are no page images to package
+    OUTPUT_PACKAGING = False
     queue = None
     page_from = 1
     PAUSE_SEC = 1
+    COMPRESS_WORKERS = 2
+    MAX_PENDING_PAGES = 8
 
     def __init__(self, config):
         self.init_non_authorized_access(config)
@@ -31,21 +37,39 @@ class PGPBDownloader(LibraryDownloader):
             self.page_from = page_from
             self.create_folders(book_id)
             self.process_book(book_id)
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
     def process_book(self, book_id):
+        if self.manifest.is_done(self.manifest.BOOK_KEY):
+            logging.info(f"Book {book_id} already downloaded")
+            return
         pages = self.extract_page_urls(book_id)
         temporary_pdf_dir = os.path.join(self.folder, "_TEMP")
         os.makedirs(temporary_pdf_dir, exist_ok=True)
-        total_page_num = len(pages)
-        for i, page in enumerate(pages):
-            self.queue.put_nowait(round(i / total_page_num, 2))
-            self.download_page(page, temporary_pdf_dir)
-            self.make_pause()
-        self.merge_pdf(book_id, temporary_pdf_dir)
+        output_filename = os.path.join(self.folder, str(book_id) + '.pdf')
+        # compression is CPU-bound, so it runs in separate processes while the next pages are downloaded,
+        # and the compressed pages are appended to the book in page order as soon as they are ready
+        compress_futures = []
+        with ProcessPoolExecutor(max_workers=self.COMPRESS_WORKERS) as compress_executor, PdfWriter() as writer:
+            def on_page_done(page_num, page_filename):
+                compress_futures.append(compress_executor.submit(timed_call, compress_pdf, page_filename,
+                                                                 page_filename[:-len(".pdf")] + ".min.pdf"))
+                self.append_compressed_pages(writer, compress_futures, self.MAX_PENDING_PAGES)
+
+            async def download_listed_page(page, page_num):
+                return await self.download_page(page, page_num, temporary_pdf_dir)
+
+            self.download_page_list(pages, download_listed_page, on_page_done)
+            self.append_compressed_pages(writer, compress_futures, 0)
+            with self.instrumentation.stage("merge"):
+                self.write_pdf(writer, output_filename)
+        self.manifest.add(self.manifest.BOOK_KEY, output_filename)
+        shutil.rmtree(temporary_pdf_dir)
 
     def extract_page_urls(self, book_id):
         url = self.PGPB_URL + self.PGPB_MAIN_SUFFIX + "/" + str(book_id)
@@ -54,35 +78,56 @@ class PGPBDownloader(LibraryDownloader):
         return [(page_tag.get("data-id"), page_tag.get("data-url"))
                 for page_tag in page_tags if page_tag.get("data-url") is not None]
 
-    def download_page(self, page, temporary_pdf_dir):
+    async def download_page(self, page, page_num, temporary_pdf_dir):
+        """
+        @return: filename of the page PDF
+        """
         page_id = page[0]
         page_id_zero_padded = page_id.zfill(5)
         page_url = page[1]
-        url = self.PGPB_URL + page_url
         output_filename = os.path.join(temporary_pdf_dir, page_id_zero_padded) + ".pdf"
-        self.save_pdf(url, output_filename)
+        if await asyncio.to_thread(self.manifest.is_done, page_num):
+            logging.info(f"Page {page_num} already downloaded")
+            return self.manifest.get_file(page_num)
+        url = self.PGPB_URL + page_url
+        checksum = await self.save_image_async(url, output_filename)
+        await asyncio.to_thread(self.manifest.add, page_num, output_filename, checksum)
         logging.info(f"Processed page {page_id}")
+        return output_filename
 
     def download_html(self, url):
-        html = requests.get(url).text
+        html = self.http_get(url).text
         return BeautifulSoup(html, features="html5lib")
 
-    def save_pdf(self, url, output_filename):
-        pdf = requests.get(url).content
-        with open(output_filename, 'wb') as fout:
-            fout.write(pdf)
-
-    def merge_pdf(self, book_id, temporary_pdf_dir):
-        with PdfWriter() as writer:
-            for item in os.listdir(temporary_pdf_dir):
-                if item.endswith(".pdf"):
-                    full_path = os.path.join(temporary_pdf_dir, item)
-                    reader = PdfReader(full_path)
-                    for page in reader.pages:
-                        page.compress_content_streams()
-                        writer.add_page(page)
-        
-        output_filename = os.path.join(self.folder, str(book_id) + '.pdf')
-        with open(output_filename, "wb") as f:
-            writer.write(f)
-        shutil.rmtree(temporary_pdf_dir)
+    def append_compressed_pages(self, writer, compress_futures, max_pending):
+        """
+        Append finished pages to the book in page order, waiting only while more than max_pending pages are queued
+        """
+        while compress_futures and (compress_futures[0].done() or len(compress_futures) > max_pending):
+            compressed_filename, compress_time = compress_futures.pop(0).result()
+            self.instrumentation.add_stage("compress", compress_time)
+            with self.instrumentation.stage("merge"):
+                for page in PdfReader(compressed_filename).pages:
+                    writer.add_page(page)
+            logging.info(f"Merged {compressed_filename}")
+
+    @staticmethod
+    def write_pdf(writer, output_filename):
+        temporary_filename = output_filename + ".part"
+        with open(temporary_filename, "wb") as fout:
+            writer.write(fout)
+        os.replace(temporary_filename, output_filename)
+
+
+def compress_pdf(input_filename, output_filename):
+    """
+    Compress the content streams of a downloaded page PDF
+    @return: output_filename
+    """
+    with PdfWriter() as writer:
+        for page in PdfReader(input_filename).pages:
+            page.compress_content_streams()
+            writer.add_page(page)
+        with open(output_filename, "wb") as fout:
+            writer.write(fout)
+    return output_filename
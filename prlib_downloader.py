@@ -2,30 +2,34 @@
 # -*- coding: utf-8 -*
 __author__ = "gisly"
 
+import asyncio
 import os
 import json
-import shutil
 
-import requests
 import logging
 from bs4 import BeautifulSoup
 import math
-from PIL import Image
-import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
 
-from abstract_lib_downloader import LibraryDownloader
+from async_lib_downloader import AsyncLibraryDownloader
+from instrumentation import timed_call
+from tile_stitcher import stitch_page
 
 
-class PRlibDownloader(LibraryDownloader):
+class PRlibDownloader(AsyncLibraryDownloader):
     METADATA_URL = "https://content.prlib.ru/metadata/public/{book_name}/{book_second_name}/{book_name}.json"
     TILE_URL = (
         "https://content.prlib.ru/fcgi-bin/iipsrv.fcgi?FIF=/var/data/scans/public/{book_name}/{book_second_name}/{page_name}&JTL={"
         "zoom},{tile_num}&CVT=JPG")
     ZOOM = 4
-    MAX_TILE_NUM = 999
+    TILE_SIZE = 256
+    STITCH_WORKERS = 2
+    MAX_PENDING_PAGES = 4
     CURRENT_TILE_NUM = 6
     BOOK_FOLDER = "prlib"
     PAUSE_SEC = 1
+    # tiles are small static images, so the host may be asked much more often than for whole pages
+    MIN_PAUSE_SEC = 0.02
 
     BOOK_URL = "https://www.prlib.ru/item/"
     current_section = "PRLIB"
@@ -44,9 +48,13 @@ class PRlibDownloader(LibraryDownloader):
             self.create_folders(book_id)
             book_url = self.BOOK_URL + book_id
             self.process_book(book_url)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
     def process_book(self, book_url):
@@ -56,18 +64,59 @@ class PRlibDownloader(LibraryDownloader):
         book_second_name = main_page.select_one("div.diva-viewer").attrs["data-filegroup"]
         book_metadata = self.get_book_metadata(book_url, main_page, book_name, book_second_name)
         pages = book_metadata["pgs"]
-        self.MAX_PAGE_WIDTH = book_metadata["pgs"][0]["d"][self.ZOOM]["w"]
-        # we count every page twice because they are first downloaded and then concatenated
-        total_page_num = len(pages) * 2
-        for page_num, page in enumerate(pages):
-            if (page_num + 1) >= self.page_from:
-                self.queue.put_nowait(round(page_num / total_page_num, 2))
-                logging.info(f"Downloading page {page_num}")
-                self.make_pause()
-                self.download_page(book_name, book_second_name, page)
-            else:
-                logging.info(f"Skipping page {page_num}")
-        self.concatenate_tiles(self.folder, total_page_num)
+        self.tile_width = book_metadata.get("t_wid", self.TILE_SIZE)
+        self.tile_height = book_metadata.get("t_hei", self.TILE_SIZE)
+        self.total_page_num = len(pages)
+        self.downloaded_page_num = 0
+        self.stitched_page_num = 0
+        # stitching is CPU-bound, so it runs in separate processes while the next pages are downloaded
+        stitch_futures = []
+        with ProcessPoolExecutor(max_workers=self.STITCH_WORKERS) as stitch_executor:
+            for page_num, page in enumerate(pages):
+                output_filename = os.path.join(self.folder, page['f'].split('.')[0] + ".jpg")
+                if (page_num + 1) >= self.page_from and not self.manifest.is_done(page_num):
+                    logging.info(f"Downloading page {page_num}")
+                    tiles = self.run_async(self.download_page(book_name, book_second_name, page))
+                    self.downloaded_page_num += 1
+                    self.report_page_progress()
+                    page_dimensions = page["d"][self.ZOOM]
+                    stitch_futures.append((page_num, stitch_executor.submit(timed_call, stitch_page, tiles,
+                                                                            page_dimensions["w"],
+                                                                            page_dimensions["h"],
+                                                                            self.tile_width, self.tile_height,
+                                                                            output_filename)))
+                else:
+                    self.downloaded_page_num += 1
+                    self.stitched_page_num += 1
+                    logging.info(f"Skipping page {page_num}")
+                    self.report_page_progress()
+                    if (page_num + 1) >= self.page_from:
+                        # a page saved in an earlier run still goes into the package after the pages before it
+                        saved_page = Future()
+                        saved_page.set_result((self.manifest.get_file(page_num), 0))
+                        stitch_futures.append((None, saved_page))
+                self.collect_stitched_pages(stitch_futures, self.MAX_PENDING_PAGES)
+            self.collect_stitched_pages(stitch_futures, 0)
+
+    def collect_stitched_pages(self, stitch_futures, max_pending):
+        """
+        Take finished pages from the stitching pool, waiting only while more than max_pending pages are queued
+        (the queued pages keep their tiles in memory)
+        """
+        while stitch_futures and (stitch_futures[0][1].done() or len(stitch_futures) > max_pending):
+            page_num, stitch_future = stitch_futures.pop(0)
+            output_filename, stitch_time = stitch_future.result()
+            self.instrumentation.add_stage("stitch", stitch_time)
+            if page_num is not None:
+                self.manifest.add(page_num, output_filename)
+                self.stitched_page_num += 1
+                logging.info(f"Stitched {output_filename}")
+                self.report_page_progress()
+            self.package_page(output_filename)
+
+    def report_page_progress(self):
+        # a page is done when it is stitched; the tiles of the next pages count as bytes meanwhile
+        self.report_progress(self.stitched_page_num, self.total_page_num)
 
     def get_book_metadata(self, book_url, main_page, book_name, book_second_name):
         metadata_json = None
@@ -96,79 +145,43 @@ class PRlibDownloader(LibraryDownloader):
             raise Exception(f"Could not get metadata for {book_url}")
         return metadata_json
 
-    def download_page(self, book_name, book_second_name, page):
+    def count_tiles(self, page):
+        """
+        IIPImage numbers the tiles of a zoom level row by row, so the grid follows from the page size
+        @return: number of tile columns and rows
+        """
+        page_dimensions = page["d"][self.ZOOM]
+        num_cols = math.ceil(page_dimensions["w"] / self.tile_width)
+        num_rows = math.ceil(page_dimensions["h"] / self.tile_height)
+        return num_cols, num_rows
+
+    async def download_page(self, book_name, book_second_name, page):
+        """
+        Up to pool_size tiles of the page are requested at a time: a tile books its slot in the rate limiter
+        only when it starts, so a 429 or Retry-After still slows down the tiles that wait
+        @return: tile contents of the page, row by row
+        """
         page_name = page['f']
-        output_folder_page = os.path.join(self.folder, page_name.split('.')[0])
-        if not os.path.exists(output_folder_page):
-            os.makedirs(output_folder_page)
-
-        tile_num = 0
-        while tile_num < self.MAX_TILE_NUM:
-            tile_url = self.TILE_URL.format(book_name=book_name, book_second_name=book_second_name, page_name=page_name,
-                                            zoom=self.ZOOM, tile_num=tile_num)
-
-            result = self.download_jpeg(output_folder_page, tile_num, tile_url)
-            if not result:
-                break
-            tile_num += 1
-
-    def download_jpeg(self, output_folder_page, tile_num, tile_url):
-        i = 0
-        while i < self.RETRY_NUM:
-            try:
-                result = self.get_page_content(tile_url)
-            except Exception as e:
-                logging.error(f"Error downloading {tile_url}: {str(e)}")
-            status_code = result.status_code
-            if status_code == 200:
-                break
-            if status_code == 404:
-                return False
-            self.make_pause()
-            i += 1
-
-        content = result.content
-        output_tile_file = os.path.join(output_folder_page, str(tile_num).zfill(5) + ".jpg")
-        with open(output_tile_file, 'wb') as fout:
-            fout.write(content)
-        return True
+
+        num_cols, num_rows = self.count_tiles(page)
+        tile_urls = [self.TILE_URL.format(book_name=book_name, book_second_name=book_second_name, page_name=page_name,
+                                          zoom=self.ZOOM, tile_num=tile_num)
+                     for tile_num in range(num_cols * num_rows)]
+        semaphore = asyncio.Semaphore(self.pool_size)
+        tasks = [asyncio.ensure_future(self.run_limited(semaphore, self.download_jpeg, tile_url))
+                 for tile_url in tile_urls]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # after an error the other tiles of the page are not needed
+            for task in tasks:
+                task.cancel()
+
+    async def download_jpeg(self, tile_url):
+        # get_page_content_async retries the errors worth retrying itself
+        result = await self.get_page_content_hedged_async(tile_url, cache_key=tile_url)
+        return result.content
 
     def download_html(self, url):
         html = self.get_page_content(url).text
         return BeautifulSoup(html, features="html5lib")
-
-    def concatenate_tiles(self, book_folder, total_page_num):
-        page_num = 0
-        for page_folder in os.listdir(book_folder):
-            full_path = os.path.join(book_folder, page_folder)
-            if os.path.isdir(full_path):
-                self.queue.put_nowait(round((page_num * 2) / total_page_num, 2))
-                page_num += 1
-                logging.info(f"Concatenating page {page_num}")
-                self.concatenate_page_tiles(os.path.join(book_folder, page_folder + ".jpg"), full_path)
-
-    def concatenate_page_tiles(self, output_filename, tile_folder):
-        list_of_images = [os.path.join(tile_folder, filename) for filename in os.listdir(tile_folder)]
-        image_first_width = Image.open(list_of_images[0]).width
-        num_cols = math.ceil(self.MAX_PAGE_WIDTH / image_first_width)
-        num_rows = math.ceil(len(list_of_images) / num_cols)
-        rows = []
-        for row_num in range(0, num_rows):
-            img_from = num_cols * row_num
-            img_to = img_from + num_cols
-            image_row = list_of_images[img_from:img_to]
-            image_arr = [np.array(Image.open(x)) for x in image_row]
-            res = image_arr[0]
-            for i in range(1, len(image_arr)):
-                res = np.concatenate([res, image_arr[i]],  axis=1)
-            concatenated = Image.fromarray(res)
-
-            rows.append(concatenated)
-        full_image = Image.fromarray(
-            np.concatenate(
-                [row for row in rows],
-                axis=0
-            ))
-        output_filename = os.path.join(output_filename)
-        full_image.save(output_filename)
-        shutil.rmtree(tile_folder)
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import threading
+import time
+
+STAGE_PAGES = "pages"
+STAGE_BOOK = "book"
+
+
+class ProgressEvent:
+    """
+    State of a download as sent to the progress queue: how many units (pages, or percents of a file)
+    of the stage are done, bytes received so far, current speed and the expected time left
+    """
+
+    def __init__(self, stage, done, total, bytes_done=0, bytes_total=None, rate=None, bytes_rate=None,
+                 eta_sec=None):
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        # units and bytes per second over the last RATE_WINDOW_SEC
+        self.rate = rate
+        self.bytes_rate = bytes_rate
+        self.eta_sec = eta_sec
+
+    @property
+    def fraction(self):
+        if self.total:
+            return min(self.done / self.total, 1.0)
+        if self.bytes_total:
+            return min(self.bytes_done / self.bytes_total, 1.0)
+        return 0.0
+
+    def to_dict(self):
+        return {"stage": self.stage, "done": self.done, "total": self.total, "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total, "rate": self.rate, "bytes_rate": self.bytes_rate,
+                "eta_sec": self.eta_sec}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class ProgressReporter:
+    """
+    Turns the counters of a download into ProgressEvents. Events are coalesced: a new one goes to the queue
+    at most every MIN_INTERVAL_SEC, except the first and the last one of a stage, so that thousands
+    of tiles do not flood the queue
+    """
+    MIN_INTERVAL_SEC = 0.5
+    RATE_WINDOW_SEC = 10
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.samples = []
+        self.last_event_time = None
+
+    def update(self, done, total, stage=STAGE_PAGES):
+        with self.lock:
+            if stage != self.stage or total != self.total:
+                self.stage = stage
+                self.total = total
+                self.samples = []
+                self.last_event_time = None
+            self.done = done
+            self.send_event(force=total is not None and done >= total)
+
+    def add_bytes(self, size):
+        with self.lock:
+            self.bytes_done += size
+            self.send_event()
+
+    def set_bytes_total(self, bytes_total):
+        with self.lock:
+            self.bytes_total = bytes_total
+
+    def send_event(self, force=False):
+        if self.queue is None or self.stage is None:
+            return
+        now = time.monotonic()
+        self.samples.append((now, self.done, self.bytes_done))
+        while len(self.samples) > 2 and self.samples[1][0] < now - self.RATE_WINDOW_SEC:
+            self.samples.pop(0)
+        if not force and self.last_event_time is not None and now - self.last_event_time < self.MIN_INTERVAL_SEC:
+            return
+        self.last_event_time = now
+        self.queue.put_nowait(self.make_event())
+
+    def make_event(self):
+        start_time, start_done, start_bytes = self.samples[0]
+        end_time = self.samples[-1][0]
+        rate = bytes_rate = eta_sec = None
+        if end_time > start_time:
+            rate = (self.done - start_done) / (end_time - start_time)
+            bytes_rate = (self.bytes_done - start_bytes) / (end_time - start_time)
+        if rate and self.total:
+            eta_sec = max(self.total - self.done, 0) / rate
+        elif bytes_rate and self.bytes_total:
+            eta_sec = max(self.bytes_total - self.bytes_done, 0) / bytes_rate
+        return ProgressEvent(self.stage, self.done, self.total, self.bytes_done, self.bytes_total,
+                             rate, bytes_rate, eta_sec)
+
+
+def format_event(event: ProgressEvent):
+    """
+    @return: text for the GUI, e.g. "стр. 12 из 300, 1.5 стр./с, 0.8 МБ/с, осталось 3:12"
+    """
+    if event.stage == STAGE_PAGES:
+        parts = [f"стр. {event.done} из {event.total}" if event.total else f"стр. {event.done}"]
+        if event.rate:
+            parts.append(f"{event.rate:.1f} стр./с")
+    else:
+        parts = [f"{round(event.fraction * 100)}%"]
+    if event.bytes_rate:
+        parts.append(f"{event.bytes_rate / (1024 * 1024):.1f} МБ/с")
+    if event.eta_sec is not None:
+        parts.append(f"осталось {format_duration(event.eta_sec)}")
+    return ", ".join(parts)
+
+
+def format_duration(seconds):
+    """
+    @return: h:mm:ss or m:ss
+    """
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
@@ -2,18 +2,19 @@
 # -*- coding: utf-8 -*
 __author__ = "gisly"
 
+import asyncio
 import base64
 import logging
 import re
-import shutil
 import os
 
-from abstract_lib_downloader import LibraryDownloader
+from async_lib_downloader import AsyncLibraryDownloader
 
 
-class RGODownloader(LibraryDownloader):
+class RGODownloader(AsyncLibraryDownloader):
     MAX_POSSIBLE_PAGE_NUM = 9999
     PAUSE_SEC = 5
+    MIN_PAUSE_SEC = 1
     BOOK_FOLDER = "rgo"
     DEFAULT_URL_PART = "safe-view/123456789/"
     current_section = "RGO"
@@ -29,43 +30,61 @@ class RGODownloader(LibraryDownloader):
             self.queue = queue
             self.page_from = page_from
             self.process_book(book_id)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
     def process_book(self, book_url):
-        i = 1
         main_page = self.download_html(book_url)
-        total_page_num = int(main_page.select("div.d-md-flex")[2].select("span")[-1].text)
+        try:
+            total_page_num = int(main_page.select("div.d-md-flex")[2].select("span")[-1].text)
+        except (IndexError, ValueError):
+            logging.error("Could not find the page count, probing the pages one by one")
+            total_page_num = 0
         book_name = book_url.split(self.DEFAULT_URL_PART)[-1].split("/")[0]
         self.create_folders(book_name)
-        while True and i < self.MAX_POSSIBLE_PAGE_NUM:
-            logging.info(f"Downloading page {i}")
-            self.make_pause()
-            result = self.download_page(book_url, i, self.folder)
-            if not result:
+
+        page_nums = list(range(max(self.page_from, 1), total_page_num + 1))
+        results = []
+
+        async def download_listed_page(page_num, _):
+            return await self.download_page(book_url, page_num, self.folder)
+
+        self.download_page_list(page_nums, download_listed_page, lambda _, result: results.append(result))
+        if None in results:
+            logging.info(f"The book ends at page {results.index(None) + page_nums[0] - 1}")
+            return
+        # the page count on the book page may be too small, the server answers "Error" after the last page
+        i = page_nums[-1] + 1 if page_nums else max(self.page_from, 1)
+        while i < self.MAX_POSSIBLE_PAGE_NUM:
+            logging.info(f"Probing page {i}")
+            output_filename = self.run_async(self.download_page(book_url, i, self.folder))
+            if output_filename is None:
                 return
-            self.queue.put_nowait(round(i / total_page_num, 2))
+            self.package_page(output_filename)
             i += 1
 
-    def download_page(self, book_url, page_num, output_folder):
+    async def download_page(self, book_url, page_num, output_folder):
+        """
+        @return: filename of the page or None if the book has no such page
+        """
+        output_filename = os.path.join(output_folder, str(page_num).zfill(5) + ".png")
+        if await asyncio.to_thread(self.manifest.is_done, page_num):
+            logging.info(f"Page {page_num} already downloaded")
+            return self.manifest.get_file(page_num)
         url = self.construct_url_page(book_url, page_num)
-        result = self.get_page_content(url)
+        result = await self.get_page_content_async(url)
         content = result.content
-        text = result.text
-        if text.startswith("Error"):
-            return False
-        with open(os.path.join(output_folder, str(page_num).zfill(5) + ".png"), "wb") as fout:
-            fout.write(content)
-        return True
-
-    @staticmethod
-    def create_zip_archive(output_folder, output_archive_name):
-        shutil.make_archive(
-            base_name=output_archive_name,
-            format="zip",
-            root_dir=output_folder)
+        if content.startswith(b"Error"):
+            return None
+        checksum = await asyncio.to_thread(self.write_page, content, output_filename)
+        await asyncio.to_thread(self.manifest.add, page_num, output_filename, checksum)
+        return output_filename
 
     @staticmethod
     def construct_url_page(book_url, page_num):
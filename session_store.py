@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class SessionStore:
+    """
+    Cookies of logged in sessions, per library and login, kept between runs so that a book does not
+    start with a form login. The file holds live sessions, so it is created readable by the user only
+    """
+    STORE_FILE = os.path.join(os.path.expanduser("~"), ".elib_downloader", "sessions.json")
+    # how long a session without expiring cookies is trusted
+    SESSION_LIFETIME_SEC = 12 * 60 * 60
+
+    def __init__(self, filename=STORE_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def get_cookies(self, section, login):
+        """
+        @return: selenium-style cookie dicts or None if there is no valid session
+        """
+        with self.lock:
+            session = self.load().get(self.get_key(section, login))
+        if session is None or session["expires"] <= time.time():
+            return None
+        return session["cookies"]
+
+    def save_cookies(self, section, login, cookies):
+        expires = time.time() + self.SESSION_LIFETIME_SEC
+        for cookie in cookies:
+            if "expiry" in cookie:
+                expires = min(expires, cookie["expiry"])
+        with self.lock:
+            sessions = self.load()
+            sessions[self.get_key(section, login)] = {"cookies": cookies, "expires": expires}
+            self.save(sessions)
+
+    def invalidate(self, section, login):
+        with self.lock:
+            sessions = self.load()
+            if sessions.pop(self.get_key(section, login), None) is not None:
+                self.save(sessions)
+
+    @staticmethod
+    def get_key(section, login):
+        return section + ":" + login
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return dict()
+        try:
+            with open(self.filename, encoding="utf-8") as fin:
+                return json.load(fin)
+        except ValueError as e:
+            logging.error(f"Ignoring broken session store {self.filename}: {e}")
+            return dict()
+
+    def save(self, sessions):
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+        temporary_filename = self.filename + ".part"
+        file_descriptor = os.open(temporary_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as fout:
+            json.dump(sessions, fout)
+        os.replace(temporary_filename, self.filename)
+
+
+SESSION_STORE = SessionStore()
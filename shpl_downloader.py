@@ -2,14 +2,15 @@
 # -*- coding: utf-8 -*
 __author__ = "gisly"
 
+import asyncio
 import json
 import logging
 import os
 
-from abstract_lib_downloader import LibraryDownloader
+from async_lib_downloader import AsyncLibraryDownloader
 
 
-class SHPLDownloader(LibraryDownloader):
+class SHPLDownloader(AsyncLibraryDownloader):
     SHPL_URL = "http://elib.shpl.ru/ru/nodes/"
     SHPL_PAGE_URL = "http://elib.shpl.ru/pages/"
     current_section = "SHPL"
@@ -27,18 +28,18 @@ class SHPLDownloader(LibraryDownloader):
             self.page_from = page_from
             self.create_folders(book_id)
             self.process_book(book_id)
+            self.finish_packaging()
+            self.log_connection_metrics()
         except Exception as e:
             logging.error(f"Exception occurred {e}")
+            self.abort_packaging()
             error_text = str(e)
+        self.save_metrics()
         return error_text, os.path.abspath(self.folder)
 
     def process_book(self, book_id):
         pages = self.extract_page_ids(book_id)
-        total_page_num = len(pages)
-        for i, page in enumerate(pages):
-            self.queue.put_nowait(round(i / total_page_num, 2))
-            self.download_page(page, i)
-            self.make_pause()
+        self.download_page_list(pages, self.download_page)
 
     def extract_page_ids(self, book_id):
         url = self.SHPL_URL + str(book_id)
@@ -47,9 +48,17 @@ class SHPLDownloader(LibraryDownloader):
         page_data = json.loads(main_page.select("script")[2].contents[0].split("(")[-1].strip().strip(")"))
         return [page["id"] for page in page_data["pages"]]
 
-    def download_page(self, page_id, page_num):
+    async def download_page(self, page_id, page_num):
+        """
+        @return: filename of the page
+        """
         page_filename = str(page_num).zfill(5)
-        url = self.SHPL_PAGE_URL + str(page_id) + "/zooms/8"
         output_filename = os.path.join(self.folder, page_filename) + ".jpeg"
-        self.save_image(url, output_filename)
-        logging.info(f"Processed page {page_num}")
\ No newline at end of file
+        if await asyncio.to_thread(self.manifest.is_done, page_num):
+            logging.info(f"Page {page_num} already downloaded")
+            return self.manifest.get_file(page_num)
+        url = self.SHPL_PAGE_URL + str(page_id) + "/zooms/8"
+        checksum = await self.save_image_async(url, output_filename, cache_key=f"{self.current_section}:{page_id}")
+        await asyncio.to_thread(self.manifest.add, page_num, output_filename, checksum)
+        logging.info(f"Processed page {page_num}")
+        return output_filename
\ No newline at end of file
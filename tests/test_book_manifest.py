@@ -0,0 +1,72 @@
+import json
+import os
+
+from book_manifest import BookManifest
+
+
+def write_page(folder, name, content):
+    filename = os.path.join(folder, name)
+    with open(filename, "wb") as fout:
+        fout.write(content)
+    return filename
+
+
+def test_added_page_is_done_after_reload(tmp_path):
+    filename = write_page(tmp_path, "00001.png", b"page")
+    BookManifest(str(tmp_path)).add(1, filename)
+    manifest = BookManifest(str(tmp_path))
+    assert manifest.is_done(1)
+    assert manifest.is_done("1")
+    assert not manifest.is_done(2)
+
+
+def test_missing_or_changed_file_is_not_done(tmp_path):
+    manifest = BookManifest(str(tmp_path))
+    first = write_page(tmp_path, "00001.png", b"page")
+    second = write_page(tmp_path, "00002.png", b"page")
+    manifest.add(1, first)
+    manifest.add(2, second)
+    os.remove(first)
+    # same size, other content
+    write_page(tmp_path, "00002.png", b"PAGE")
+    assert not manifest.is_done(1)
+    assert not manifest.is_done(2)
+
+
+def test_wrong_checksum_is_not_done(tmp_path):
+    filename = write_page(tmp_path, "00001.png", b"page")
+    manifest = BookManifest(str(tmp_path))
+    manifest.add(1, filename, checksum="0" * 64)
+    assert not manifest.is_done(1)
+
+
+def test_broken_manifest_is_ignored(tmp_path):
+    with open(tmp_path / BookManifest.MANIFEST_FILE, "w", encoding="utf-8") as fout:
+        fout.write("{not json")
+    manifest = BookManifest(str(tmp_path))
+    assert not manifest.is_done(1)
+    manifest.add(1, write_page(tmp_path, "00001.png", b"page"))
+    with open(tmp_path / BookManifest.MANIFEST_FILE, encoding="utf-8") as fin:
+        assert "1" in json.load(fin)["pages"]
+
+
+def test_manifest_is_written_atomically(tmp_path):
+    BookManifest(str(tmp_path)).add(BookManifest.BOOK_KEY, write_page(tmp_path, "book.pdf", b"%PDF"))
+    assert sorted(os.listdir(tmp_path)) == ["book.pdf", BookManifest.MANIFEST_FILE]
+
+
+def test_recompressed_page_is_found_by_either_file(tmp_path):
+    original = write_page(tmp_path, "00001.png", b"page")
+    manifest = BookManifest(str(tmp_path))
+    manifest.add(1, original)
+    assert manifest.get_file(1) == original
+    assert manifest.get_file(2) is None
+    recompressed = write_page(tmp_path, "00001.webp", b"pg")
+    os.remove(original)
+    manifest.replace_file(original, recompressed, BookManifest.file_checksum(recompressed))
+    manifest = BookManifest(str(tmp_path))
+    assert manifest.is_done(1)
+    assert manifest.get_file(1) == recompressed
+    assert manifest.get_recompressed_file(original) == recompressed
+    assert manifest.get_recompressed_file(recompressed) == recompressed
+    assert manifest.get_savings() == 2
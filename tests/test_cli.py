@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import cli
+from batch_queue import BatchJob, JobQueue
+
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    """
+    Replaces the libraries with one that records the folder of every download; book ids starting
+    with "bad" fail
+    """
+    monkeypatch.chdir(tmp_path)
+    with open("config.ini", "w", encoding="utf-8") as fout:
+        fout.write("[SHPL]\nfolder = config_folder\n")
+    calls = []
+
+    def download(config, book_id, queue):
+        calls.append((book_id, config["SHPL"]["folder"]))
+        if book_id.startswith("bad"):
+            return "failed", None
+        return None, config["SHPL"]["folder"]
+
+    monkeypatch.setattr(cli, "DOWNLOAD_FUNCTIONS", {"SHPL": download})
+    monkeypatch.setattr(cli, "POLL_INTERVAL_SEC", 0.01)
+    return calls
+
+
+def read_events(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_job_list_resumes_in_the_folder_of_its_jobs(downloads, capsys):
+    # a run stopped in the middle of the book left it queued
+    JobQueue("jobs.json").add("SHPL", "1", "books")
+    assert cli.main(["--jobs-file", "jobs.json"]) == 0
+    assert downloads == [("1", "books")]
+    assert read_events(capsys)[-1] == {"event": "finished", "books": 1, "failed": 0}
+    assert [job.status for job in JobQueue("jobs.json").get_jobs()] == [BatchJob.STATUS_DONE]
+
+
+def test_book_given_again_without_folder_is_not_added_twice(downloads, capsys):
+    assert cli.main(["--source", "SHPL", "--folder", "books", "--jobs-file", "jobs.json", "bad1", "2"]) == 1
+    assert cli.main(["--source", "SHPL", "--jobs-file", "jobs.json", "bad1"]) == 1
+    assert sorted(downloads) == [("2", "books"), ("bad1", "books"), ("bad1", "books")]
+    assert read_events(capsys)[-1] == {"event": "finished", "books": 1, "failed": 1}
+    assert len(JobQueue("jobs.json").get_jobs()) == 2
+
+
+def test_folder_of_config_is_used_without_folder(downloads):
+    assert cli.main(["--source", "SHPL", "--jobs-file", "jobs.json", "1"]) == 0
+    assert downloads == [("1", "config_folder")]
+    assert cli.main(["--jobs-file", "jobs.json"]) == 0
+    assert downloads == [("1", "config_folder")]
@@ -0,0 +1,51 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from instrumentation import BookInstrumentation, TimedHTTPAdapter
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.write(b"page")
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_port}/page"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connection_phases_are_measured_through_urllib3(server_url):
+    # fails if the urllib3 internals the timed connections override have changed
+    instrumentation = BookInstrumentation("TEST")
+    session = requests.Session()
+    session.mount("http://", TimedHTTPAdapter())
+    timings = []
+    for _ in range(2):
+        timing = instrumentation.start_request(server_url)
+        result = session.get(server_url)
+        instrumentation.finish_request(timing, result.status_code, len(result.content))
+        timings.append(timing)
+    assert result.content == b"page"
+    assert timings[0].new_connection
+    assert timings[0].phases["dns"] > 0
+    assert timings[0].phases["connect"] > 0
+    assert timings[0].phases["ttfb"] > 0
+    # the second request reused the connection
+    assert not timings[1].new_connection
+    assert timings[1].phases["ttfb"] > 0
@@ -0,0 +1,82 @@
+import os
+import zlib
+
+from PIL import Image
+from PyPDF2 import PdfReader
+
+from output_packager import PdfPackager
+
+
+def save_image(folder, name, mode, size, image_format, **params):
+    filename = os.path.join(folder, name)
+    color = {"L": 128, "RGB": (200, 100, 50), "CMYK": (10, 20, 30, 40), "RGBA": (0, 0, 255, 128)}.get(mode, 3)
+    Image.new(mode, size, color).save(filename, image_format, **params)
+    return filename
+
+
+def package(folder, filenames):
+    packager = PdfPackager(os.path.join(folder, "book"))
+    for filename in filenames:
+        packager.add_page(filename)
+    return packager.finish()
+
+
+def get_image(page):
+    return page["/Resources"]["/XObject"]["/Im0"].get_object()
+
+
+def test_jpeg_pages_are_embedded_as_they_are(tmp_path):
+    filenames = [save_image(tmp_path, f"{mode}.jpg", mode, (40, 30), "JPEG") for mode in ("RGB", "L", "CMYK")]
+    reader = PdfReader(package(str(tmp_path), filenames))
+    assert len(reader.pages) == 3
+    for page, filename, color_space in zip(reader.pages, filenames, ("/DeviceRGB", "/DeviceGray", "/DeviceCMYK")):
+        image = get_image(page)
+        assert image["/Filter"] == "/DCTDecode"
+        assert image["/ColorSpace"] == color_space
+        with open(filename, "rb") as fin:
+            assert image.get_data() == fin.read()
+    assert "/Decode" in get_image(reader.pages[2])
+
+
+def test_page_size_follows_dpi(tmp_path):
+    filenames = [save_image(tmp_path, "72.jpg", "RGB", (144, 72), "JPEG", dpi=(72, 72)),
+                 save_image(tmp_path, "default.png", "RGB", (96, 48), "PNG")]
+    reader = PdfReader(package(str(tmp_path), filenames))
+    assert [float(value) for value in reader.pages[0].mediabox] == [0, 0, 144, 72]
+    assert [float(value) for value in reader.pages[1].mediabox] == [0, 0, 72, 36]
+
+
+def test_png_data_is_reused_with_predictor(tmp_path):
+    filename = save_image(tmp_path, "page.png", "RGB", (20, 10), "PNG")
+    image = get_image(PdfReader(package(str(tmp_path), [filename])).pages[0])
+    assert image["/Filter"] == "/FlateDecode"
+    assert image["/DecodeParms"]["/Predictor"] == 15
+    assert image["/DecodeParms"]["/Colors"] == 3
+
+
+def test_transparent_and_palette_images_are_decoded(tmp_path):
+    filenames = [save_image(tmp_path, "rgba.png", "RGBA", (8, 4), "PNG"),
+                 save_image(tmp_path, "palette.png", "P", (8, 4), "PNG"),
+                 save_image(tmp_path, "page.gif", "L", (8, 4), "GIF")]
+    reader = PdfReader(package(str(tmp_path), filenames))
+    assert len(reader.pages) == 3
+    for page in reader.pages:
+        image = get_image(page)
+        assert "/DecodeParms" not in image
+        components = 1 if image["/ColorSpace"] == "/DeviceGray" else 3
+        assert len(zlib.decompress(image._data)) == 8 * 4 * components
+
+
+def test_book_without_pages_leaves_no_file(tmp_path):
+    packager = PdfPackager(os.path.join(str(tmp_path), "book"))
+    assert packager.finish() is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_abort_removes_unfinished_file(tmp_path):
+    packager = PdfPackager(os.path.join(str(tmp_path), "book"))
+    packager.add_page(save_image(tmp_path, "page.jpg", "RGB", (8, 4), "JPEG"))
+    assert os.path.exists(packager.temporary_filename)
+    packager.abort()
+    assert not os.path.exists(packager.temporary_filename)
+    assert not os.path.exists(packager.output_filename)
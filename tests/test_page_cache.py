@@ -0,0 +1,59 @@
+import os
+
+from page_cache import PageCache
+
+
+def count_files(folder):
+    return sum(len(names) for _, _, names in os.walk(folder))
+
+
+def test_cached_content_is_found_by_key(tmp_path):
+    cache = PageCache(str(tmp_path), 1024)
+    cache.put("SHPL:1", b"page")
+    assert cache.get("SHPL:1") == b"page"
+    assert cache.get("SHPL:2") is None
+
+
+def test_same_content_is_stored_once(tmp_path):
+    cache = PageCache(str(tmp_path), 1024)
+    cache.put("SHPL:1", b"page")
+    cache.put("https://example.org/1", b"page")
+    assert cache.get("https://example.org/1") == b"page"
+    assert count_files(tmp_path / PageCache.OBJECTS_FOLDER) == 1
+    assert count_files(tmp_path / PageCache.KEYS_FOLDER) == 2
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = PageCache(str(tmp_path), 0)
+    cache.put("SHPL:1", b"page")
+    assert cache.get("SHPL:1") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_least_recently_used_pages_are_evicted_with_their_keys(tmp_path):
+    cache = PageCache(str(tmp_path), 200)
+    for i in range(5):
+        cache.put(f"page{i}", bytes([i]) * 40)
+        with open(cache.get_key_filename(f"page{i}"), encoding="ascii") as fin:
+            object_filename = cache.get_object_filename(fin.read())
+        os.utime(object_filename, (1000 + i, 1000 + i))
+    # a hit makes the oldest page the most recently used
+    assert cache.get("page0") == bytes([0]) * 40
+    cache.put("page5", bytes([5]) * 40)
+    assert cache.current_size <= 200 * PageCache.EVICTION_TARGET
+    assert cache.get("page1") is None
+    assert cache.get("page2") is None
+    assert cache.get("page0") is not None
+    assert cache.get("page3") is not None
+    assert cache.get("page5") is not None
+    assert not os.path.exists(cache.get_key_filename("page1"))
+    assert not os.path.exists(cache.get_key_filename("page2"))
+    assert count_files(tmp_path / PageCache.KEYS_FOLDER) == count_files(tmp_path / PageCache.OBJECTS_FOLDER)
+
+
+def test_size_of_existing_cache_is_counted(tmp_path):
+    PageCache(str(tmp_path), 100).put("page0", b"0" * 60)
+    cache = PageCache(str(tmp_path), 100)
+    cache.put("page1", b"1" * 60)
+    assert cache.get("page0") is None
+    assert cache.get("page1") == b"1" * 60
@@ -0,0 +1,100 @@
+import pytest
+
+from nlrs_downloader import NLRSDownloader, PageLinkTemplate
+
+BOOK_URL = "https://e.nlrs.ru/open/1234/"
+
+
+def test_unpadded_page_number():
+    template = PageLinkTemplate.from_neighbour_links(BOOK_URL + "page9.png", 9, BOOK_URL + "page10.png")
+    assert template.get_url(9) == BOOK_URL + "page9.png"
+    assert template.get_url(120) == BOOK_URL + "page120.png"
+
+
+def test_padded_page_number_keeps_width():
+    template = PageLinkTemplate.from_neighbour_links(BOOK_URL + "0009.png?w=1200", 9, BOOK_URL + "0010.png?w=1200")
+    assert template.get_url(1) == BOOK_URL + "0001.png?w=1200"
+    assert template.get_url(250) == BOOK_URL + "0250.png?w=1200"
+
+
+def test_offset_between_page_and_file_number():
+    # the viewer counts pages from 1, the files from 0
+    template = PageLinkTemplate.from_neighbour_links(BOOK_URL + "img_4.jpg", 5, BOOK_URL + "img_5.jpg")
+    assert template.get_url(1) == BOOK_URL + "img_0.jpg"
+    assert template.get_url(6) == BOOK_URL + "img_5.jpg"
+
+
+@pytest.mark.parametrize("link, next_link", [
+    # nothing differs
+    (BOOK_URL + "page9.png", BOOK_URL + "page9.png"),
+    # the number grows by more than one
+    (BOOK_URL + "page9.png", BOOK_URL + "page11.png"),
+    # the number goes down
+    (BOOK_URL + "page10.png", BOOK_URL + "page9.png"),
+    # two numbers differ
+    (BOOK_URL + "page9.png?t=100", BOOK_URL + "page10.png?t=200"),
+    # a text part differs
+    (BOOK_URL + "page9.png", BOOK_URL + "page9.jpg"),
+    # different structure
+    (BOOK_URL + "page9.png", BOOK_URL + "page/10/x.png"),
+])
+def test_links_that_are_not_neighbours(link, next_link):
+    assert PageLinkTemplate.from_neighbour_links(link, 9, next_link) is None
+
+
+class FakeViewer:
+    """
+    Pages of the NLRS viewer: the buttons move it at once, the image of the new page comes image_delay calls later
+    """
+
+    def __init__(self, page, image_delay=0):
+        self.page = page
+        self.image_page = page
+        self.image_delay = image_delay
+        self.calls = 0
+
+    def click_next(self):
+        self.page += 1
+        self.calls = 0
+
+    def click_previous(self):
+        self.page -= 1
+        self.calls = 0
+
+    def get_image_link(self):
+        self.calls += 1
+        if self.calls > self.image_delay:
+            self.image_page = self.page
+        return BOOK_URL + f"{self.image_page - 1:04}.png"
+
+
+class Button:
+    def __init__(self, on_click):
+        self.click = on_click
+
+
+def make_downloader(viewer, page_from, last_page):
+    downloader = NLRSDownloader.__new__(NLRSDownloader)
+    downloader.driver = None
+    downloader.page_from = page_from
+    downloader.last_page = last_page
+    downloader.PAGE_LOAD_TIMEOUT_SEC = 0.1
+    downloader.get_image_link = viewer.get_image_link
+    downloader.get_viewer_page = lambda: viewer.page
+    downloader.get_next_page_button = lambda: Button(viewer.click_next)
+    downloader.get_previous_page_button = lambda: Button(viewer.click_previous)
+    return downloader
+
+
+def test_template_from_the_page_the_viewer_shows():
+    # the slider did not move, the viewer stays on page 1 while the download starts from page 5
+    viewer = FakeViewer(1)
+    template = make_downloader(viewer, 5, 20).resolve_page_link_template(1)
+    assert template.get_url(5) == BOOK_URL + "0004.png"
+    assert viewer.page == 1
+
+
+def test_late_image_leaves_the_viewer_where_it_was():
+    viewer = FakeViewer(3, image_delay=10 ** 9)
+    assert make_downloader(viewer, 3, 20).resolve_page_link_template(3) is None
+    assert viewer.page == 3
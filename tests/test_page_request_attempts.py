@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import requests
+
+from abstract_lib_downloader import AuthorizationRequired, LibraryDownloader, PageRequestAttempts
+from async_lib_downloader import AsyncLibraryDownloader
+from instrumentation import BookInstrumentation
+from page_cache import PageCache
+
+URL = "https://example.org/page"
+
+
+def make_downloader(cls=LibraryDownloader, cache_folder=None):
+    downloader = cls.__new__(cls)
+    downloader.current_section = "TEST"
+    downloader.instrumentation = BookInstrumentation("TEST")
+    downloader.page_cache = PageCache(cache_folder or "", 1024 if cache_folder else 0)
+    downloader.get_retry_pause = lambda attempt: attempt / 100
+    return downloader
+
+
+def make_response(status_code, content=b""):
+    return AsyncLibraryDownloader.make_response(URL, status_code, {}, content)
+
+
+def test_server_errors_are_retried_with_growing_pauses():
+    attempts = PageRequestAttempts(make_downloader(), URL)
+    assert attempts.after_response(make_response(503)) == 0.01
+    assert attempts.after_response(make_response(500)) == 0.02
+    with pytest.raises(Exception, match="503"):
+        attempts.after_response(make_response(503))
+
+
+def test_rate_limited_answers_have_their_own_budget_and_no_pause():
+    downloader = make_downloader()
+    attempts = PageRequestAttempts(downloader, URL)
+    assert attempts.after_response(make_response(503)) == 0.01
+    for _ in range(downloader.RATE_LIMIT_RETRY_NUM - 1):
+        assert attempts.after_response(make_response(429)) == 0
+    with pytest.raises(Exception, match="429"):
+        attempts.after_response(make_response(429))
+
+
+def test_page_and_final_errors_end_the_attempts():
+    attempts = PageRequestAttempts(make_downloader(), URL)
+    assert attempts.after_response(make_response(200)) is None
+    with pytest.raises(Exception, match="404"):
+        attempts.after_response(make_response(404))
+    with pytest.raises(AuthorizationRequired):
+        attempts.after_response(make_response(401))
+
+
+def test_connection_errors_are_raised_after_the_last_attempt():
+    attempts = PageRequestAttempts(make_downloader(), URL)
+    error = requests.ConnectionError("refused")
+    assert attempts.after_error(error) == 0.01
+    assert attempts.after_error(error) == 0.02
+    with pytest.raises(requests.ConnectionError):
+        attempts.after_error(error)
+
+
+def test_sync_and_async_requests_retry_and_cache_alike(tmp_path):
+    answers = [requests.Timeout(), make_response(503), make_response(429), make_response(200, b"page")]
+
+    def http_get(url, headers=None, stream=False):
+        answer = sync_answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def http_get_async(url, headers=None):
+        answer = async_answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    sync_answers = list(answers)
+    downloader = make_downloader(cache_folder=str(tmp_path / "sync"))
+    downloader.http_get = http_get
+    downloader.wait_before_retry = lambda pause: None
+    assert downloader.get_page_content(URL, cache_key="page").content == b"page"
+    assert downloader.get_page_content(URL, cache_key="page").content == b"page"
+
+    async_answers = [asyncio.TimeoutError()] + answers[1:]
+    async_downloader = make_downloader(AsyncLibraryDownloader, str(tmp_path / "async"))
+    async_downloader.http_get_async = http_get_async
+
+    async def wait_before_retry_async(pause):
+        pass
+
+    async_downloader.wait_before_retry_async = wait_before_retry_async
+    for _ in range(2):
+        result = asyncio.run(async_downloader.get_page_content_async(URL, cache_key="page"))
+        assert result.content == b"page"
+
+    # the second request of each came from the page cache
+    assert sync_answers == async_answers == []
+    assert downloader.instrumentation.retries == async_downloader.instrumentation.retries == 3
@@ -0,0 +1,145 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import abstract_lib_downloader
+from abstract_lib_downloader import HostRateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(abstract_lib_downloader.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_reserve_spaces_requests_by_pause():
+    limiter = HostRateLimiter(1, 0.25, 60)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(1, abs=0.01)
+    # a waiting request does not book a slot
+    assert limiter.reserve() == pytest.approx(1, abs=0.01)
+
+
+def test_waiting_request_sees_a_later_backoff():
+    limiter = HostRateLimiter(0.1, 0.1, 60)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+    limiter.record(429, 0.1, retry_after=5)
+    assert limiter.reserve() == pytest.approx(5, abs=0.1)
+
+
+def test_wait_takes_the_slot_once_it_comes():
+    limiter = HostRateLimiter(0.05, 0.05, 60)
+    assert limiter.wait() == 0
+    assert limiter.wait() == pytest.approx(0.05, abs=0.02)
+
+
+def test_overload_multiplies_pause_up_to_maximum(clock):
+    limiter = HostRateLimiter(1, 0.25, 3)
+    limiter.record(429, 0.1)
+    assert limiter.pause_sec == 2
+    clock.now += 2
+    limiter.record(503, 0.1)
+    assert limiter.pause_sec == 3
+    clock.now += 3
+    limiter.record(429, 0.1)
+    assert limiter.pause_sec == 3
+
+
+def test_answers_in_flight_back_off_once(clock):
+    limiter = HostRateLimiter(1, 0.25, 60)
+    for _ in range(5):
+        limiter.record(429, 0.1)
+    assert limiter.pause_sec == 2
+    clock.now += 2
+    limiter.record(429, 0.1)
+    assert limiter.pause_sec == 4
+
+
+def test_backoff_from_zero_pause_has_a_floor():
+    limiter = HostRateLimiter(0, 0, 60)
+    limiter.record(429, 0.1)
+    assert limiter.pause_sec == HostRateLimiter.MIN_BACKOFF_PAUSE_SEC
+    assert limiter.reserve() > 0
+
+
+def test_overload_delays_the_next_slot_by_retry_after():
+    limiter = HostRateLimiter(0.5, 0.25, 60)
+    limiter.record(429, 0.1, retry_after=10)
+    assert limiter.reserve() == pytest.approx(10, abs=0.1)
+
+
+def test_successful_answers_shrink_pause_to_minimum():
+    limiter = HostRateLimiter(1, 0.25, 60)
+    for _ in range(100):
+        limiter.record(200, 0.1)
+    assert limiter.pause_sec == 0.25
+
+
+def test_other_errors_do_not_change_pause():
+    limiter = HostRateLimiter(1, 0.25, 60)
+    limiter.record(404, 0.1)
+    assert limiter.pause_sec == 1
+
+
+def test_slow_answers_back_off():
+    limiter = HostRateLimiter(1, 0.25, 60)
+    limiter.record(200, 0.1)
+    pause = limiter.pause_sec
+    for _ in range(20):
+        limiter.record(200, 5)
+        if limiter.pause_sec > pause:
+            break
+    assert limiter.pause_sec > pause
+
+
+def test_small_latency_differences_do_not_back_off():
+    limiter = HostRateLimiter(1, 0, 60)
+    # a tiny HTML page, then images of the same host
+    limiter.record(200, 0.001)
+    for _ in range(100):
+        limiter.record(200, 0.05)
+    assert limiter.pause_sec == 0
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("", None), ("5", 5), ("-3", 0), ("soon", None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert HostRateLimiter.parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    value = formatdate(time.time() + 30, usegmt=True)
+    assert HostRateLimiter.parse_retry_after(value) == pytest.approx(30, abs=2)
+
+
+def test_pause_recovers_from_backoff_in_tens_of_answers(clock):
+    limiter = HostRateLimiter(1, 0.25, 60)
+    for _ in range(5):
+        limiter.record(429, 0.1)
+        clock.now += limiter.pause_sec
+    assert limiter.pause_sec == 32
+    for _ in range(60):
+        limiter.record(200, 0.1)
+    assert limiter.pause_sec == 0.25
+
+
+@pytest.mark.parametrize("pause_sec, min_pause_sec", [(1, 0.25), (1, 0.02), (0, 0)])
+def test_steady_share_of_429_keeps_pause_bounded(clock, pause_sec, min_pause_sec):
+    limiter = HostRateLimiter(pause_sec, min_pause_sec, 60)
+    pauses = []
+    for i in range(1000):
+        # one request at a time, each in its own slot
+        clock.now += limiter.pause_sec + 0.1
+        limiter.record(429 if i % 10 == 0 else 200, 0.1)
+        pauses.append(limiter.pause_sec)
+    assert max(pauses) <= max(2 * pause_sec, HostRateLimiter.MIN_BACKOFF_PAUSE_SEC)
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*
+__author__ = "gisly"
+
+import io
+import math
+
+from PIL import Image
+
+
+def stitch_page(tiles, page_width, page_height, tile_width, tile_height, output_filename):
+    """
+    Paste the tiles of a page into one canvas and save it
+    @param tiles: encoded tile images (bytes), row by row
+    @return: output filename
+    """
+    num_cols = math.ceil(page_width / tile_width)
+    page_image = None
+    for tile_num, tile in enumerate(tiles):
+        with Image.open(io.BytesIO(tile)) as tile_image:
+            if page_image is None:
+                page_image = Image.new(tile_image.mode, (page_width, page_height))
+            row_num, col_num = divmod(tile_num, num_cols)
+            page_image.paste(tile_image, (col_num * tile_width, row_num * tile_height))
+    if page_image is None:
+        raise Exception(f"No tiles for {output_filename}")
+    page_image.save(output_filename)
+    return output_filename